@@ -0,0 +1,210 @@
+""" LUNA Discourse command line interface: info, stats, convert, verify, patch & bench in a single process """
+
+__author__ = "Evgeny A. Stepanov"
+__email__ = "stepanov.evgeny.a@gmail.com"
+__status__ = "dev"
+__version__ = "0.1.0"
+
+
+import typing as t
+
+import os
+import sys
+import argparse
+
+
+# import time budget (seconds) on top of bare interpreter startup for cli & reader modules
+STARTUP_BUDGET = 0.1
+STARTUP_MODULES = ["cli", "dialog", "corpus", "parser", "patch", "test"]
+
+
+# subcommands: heavy modules are imported on demand
+def run_info(args):
+    from dialog import load
+
+    for path in args.data:
+        print(load(path).info)
+
+
+def run_stats(args):
+    from corpus import Corpus, label_table
+
+    for path in args.data:
+        corpus = Corpus(path, patches=args.patches)
+        print(label_table(corpus) if args.table else corpus.stats(args.part))
+
+
+def run_convert(args):
+    from parser import parse_dialog, parse_mask
+
+    masker = parse_mask(args.mask) if args.mask else None
+
+    for raw_path, ann_path in pair_paths(args.raw, args.ann):
+        dialog = parse_dialog(raw_path, ann_path)
+
+        if masker:
+            masker_tokens = masker.get(dialog.doc_id)
+            if masker_tokens is None:
+                raise ValueError(f"No masked tokens: {dialog.doc_id}")
+            if len(masker_tokens) != len(dialog.tokens):
+                raise ValueError(f"Masked tokens mismatch: {len(masker_tokens)} != {len(dialog.tokens)}")
+            dialog.tokens = masker_tokens
+
+        dialog.dump(os.path.join(args.odir, f"{dialog.doc_id}.json"))
+        print(dialog.info)
+
+
+def run_verify(args):
+    from test import test_conversion
+
+    failed = 0
+    for raw_path, ann_path in pair_paths(args.raw, args.ann):
+        try:
+            test_conversion(raw_path, ann_path)
+            print(f"OK: {raw_path}")
+        except AssertionError:
+            failed += 1
+            print(f"FAILED: {raw_path}")
+        except Exception as e:
+            failed += 1
+            print(f"FAILED: {raw_path}: {e!r}")
+
+    if failed:
+        sys.exit(1)
+
+
+def run_patch(args):
+    from patch import check_patches, find_patches
+
+    for path in args.data:
+        patch_path = find_patches(path, args.patch)
+        if patch_path is None:
+            print(f"No patch file: {path}")
+            continue
+        for edit in check_patches(path, patch_path):
+            print(edit)
+
+
+def run_bench(args):
+    result = benchmark_startup(runs=args.runs)
+    print(result)
+
+    if result.get("overhead") > result.get("budget"):
+        sys.exit(1)
+
+
+def pair_paths(raw: t.List[str], ann: t.List[str]) -> t.List[t.Tuple[str, str]]:
+    """
+    pair raw text & annotation files; directories are paired by file names
+    :param raw: raw text files or directories
+    :param ann: annotation files or directories (same number as raw)
+    :return:
+    """
+    if len(raw) != len(ann):
+        raise ValueError(f"Different number of raw & annotation paths: {len(raw)} != {len(ann)}")
+
+    pairs = []
+    for raw_path, ann_path in zip(raw, ann):
+        if os.path.isdir(raw_path):
+            from corpus import read_dir
+            pairs.extend([(os.path.join(raw_path, f), os.path.join(ann_path, f)) for f in sorted(read_dir(raw_path))])
+        else:
+            pairs.append((raw_path, ann_path))
+    return pairs
+
+
+def benchmark_startup(runs: int = 5, modules: t.List[str] = None) -> t.Dict[str, float]:
+    """
+    measure startup time of a fresh interpreter importing modules (best of runs) w.r.t. bare interpreter;
+    also checks that NumPy is not imported at startup
+    :param runs: number of runs
+    :param modules: modules to import
+    :return:
+    """
+    import time
+    import subprocess
+
+    modules = STARTUP_MODULES if modules is None else modules
+    code = f"import sys, {', '.join(modules)}; sys.exit('numpy' in sys.modules)"
+
+    def measure(command: str) -> float:
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, "-c", command], cwd=os.path.dirname(os.path.abspath(__file__)))
+            timings.append(time.perf_counter() - start)
+            if process.returncode:
+                raise RuntimeError(f"Startup imports NumPy or failed: {command}")
+        return min(timings)
+
+    python = measure("pass")
+    startup = measure(code)
+
+    return {"python": python, "startup": startup, "overhead": startup - python, "budget": STARTUP_BUDGET}
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="LUNA Discourse CLI", prog='PROG')
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add_command_info(commands)
+    add_command_stats(commands)
+    add_command_convert(commands)
+    add_command_verify(commands)
+    add_command_patch(commands)
+    add_command_bench(commands)
+
+    return parser
+
+
+def add_command_info(commands):
+    command = commands.add_parser("info", help="print dialog info")
+    command.add_argument('data', nargs='+', help="paths to dialog files")
+    command.set_defaults(func=run_info)
+
+
+def add_command_stats(commands):
+    command = commands.add_parser("stats", help="print corpus stats")
+    command.add_argument('data', nargs='+', help="paths to data")
+    command.add_argument('-p', '--part', required=False, help="split of data")
+    command.add_argument('--patches', required=False, help="path to patch file (default: patches.json in data)")
+    command.add_argument('--no-patches', dest='patches', action='store_const', const=False,
+                         help="do not apply patches")
+    command.add_argument('-t', '--table', action='store_true', help="print relation type distribution table")
+    command.set_defaults(func=run_stats)
+
+
+def add_command_convert(commands):
+    command = commands.add_parser("convert", help="convert raw text & annotation files")
+    command.add_argument('-r', '--raw', nargs='+', required=True, help="paths to raw text files or directories")
+    command.add_argument('-a', '--ann', nargs='+', required=True, help="paths to annotation files or directories")
+    command.add_argument('-o', '--odir', default='.', help="path to output directory")
+    command.add_argument('-m', '--mask', required=False, help="path to masked file")
+    command.set_defaults(func=run_convert)
+
+
+def add_command_verify(commands):
+    command = commands.add_parser("verify", help="verify conversion of raw text & annotation files")
+    command.add_argument('-r', '--raw', nargs='+', required=True, help="paths to raw text files or directories")
+    command.add_argument('-a', '--ann', nargs='+', required=True, help="paths to annotation files or directories")
+    command.set_defaults(func=run_verify)
+
+
+def add_command_patch(commands):
+    command = commands.add_parser("patch", help="report patch overlay edits")
+    command.add_argument('data', nargs='*', default=['data'], help="paths to data")
+    command.add_argument('-p', '--patch', required=False, help="path to patch file (default: patches.json in data)")
+    command.set_defaults(func=run_patch)
+
+
+def add_command_bench(commands):
+    command = commands.add_parser("bench", help="benchmark startup time")
+    command.add_argument('-n', '--runs', type=int, default=5, help="number of runs")
+    command.set_defaults(func=run_bench)
+
+
+if __name__ == "__main__":
+    arg_parser = create_argument_parser()
+    args = arg_parser.parse_args()
+
+    args.func(args)
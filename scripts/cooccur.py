@@ -0,0 +1,260 @@
+""" Connective & Sense Co-occurrence Statistics for LUNA Discourse Data """
+
+__author__ = "Evgeny A. Stepanov"
+__email__ = "stepanov.evgeny.a@gmail.com"
+__status__ = "dev"
+__version__ = "0.1.0"
+
+
+import typing as t
+
+import numpy as np
+
+from dialog import SENSE_LEVEL, Dialog, DiscourseRelation
+from dialog import slice_sequence, reduce_sense
+from corpus import Corpus
+
+import argparse
+
+
+# relation-level dimensions to cross-tabulate
+DIMENSIONS = ["connective", "conns", "sense", "label", "part", "doc_id"]
+
+
+class Contingency:
+
+    def __init__(self,
+                 rows: t.List[t.Any],
+                 cols: t.List[t.Any],
+                 row_ids: np.ndarray,
+                 col_ids: np.ndarray,
+                 counts: np.ndarray):
+        """
+        sparse (coordinate format) integer contingency table over interned row & column values
+        :param rows: row vocabulary
+        :param cols: column vocabulary
+        :param row_ids: row indices of non-zero cells
+        :param col_ids: column indices of non-zero cells
+        :param counts: non-zero cell counts
+        """
+        self.rows = rows
+        self.cols = cols
+        self.row_ids = row_ids
+        self.col_ids = col_ids
+        self.counts = counts
+
+        self.row_index = {v: i for i, v in enumerate(rows)}
+        self.col_index = {v: i for i, v in enumerate(cols)}
+
+    @property
+    def shape(self) -> t.Tuple[int, int]:
+        return len(self.rows), len(self.cols)
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def dense(self) -> np.ndarray:
+        """
+        return table as a dense matrix
+        :return:
+        """
+        matrix = np.zeros(self.shape, dtype=np.int64)
+        matrix[self.row_ids, self.col_ids] = self.counts
+        return matrix
+
+    def get(self, row: t.Any, col: t.Any) -> int:
+        """
+        cell count
+        :param row: row value
+        :param col: column value
+        :return:
+        """
+        if row not in self.row_index or col not in self.col_index:
+            return 0
+        mask = (self.row_ids == self.row_index[row]) & (self.col_ids == self.col_index[col])
+        return int(self.counts[mask].sum())
+
+    def row(self, row: t.Any) -> t.Dict[t.Any, int]:
+        """
+        non-zero column counts for a row value
+        :param row:
+        :return:
+        """
+        mask = self.row_ids == self.row_index.get(row, -1)
+        return {self.cols[j]: int(c) for j, c in zip(self.col_ids[mask], self.counts[mask])}
+
+    def col(self, col: t.Any) -> t.Dict[t.Any, int]:
+        """
+        non-zero row counts for a column value
+        :param col:
+        :return:
+        """
+        mask = self.col_ids == self.col_index.get(col, -1)
+        return {self.rows[i]: int(c) for i, c in zip(self.row_ids[mask], self.counts[mask])}
+
+    def row_totals(self) -> t.Dict[t.Any, int]:
+        totals = np.bincount(self.row_ids, weights=self.counts, minlength=len(self.rows)).astype(np.int64)
+        return dict(zip(self.rows, totals.tolist()))
+
+    def col_totals(self) -> t.Dict[t.Any, int]:
+        totals = np.bincount(self.col_ids, weights=self.counts, minlength=len(self.cols)).astype(np.int64)
+        return dict(zip(self.cols, totals.tolist()))
+
+    def ambiguity(self) -> t.Dict[t.Any, t.Dict[str, float]]:
+        """
+        per row value: number of distinct column values, share of the most frequent one & entropy (bits)
+        e.g. connective ambiguity w.r.t. senses
+        :return:
+        """
+        totals = np.bincount(self.row_ids, weights=self.counts, minlength=len(self.rows))
+        distinct = np.bincount(self.row_ids, minlength=len(self.rows))
+
+        top = np.zeros(len(self.rows))
+        np.maximum.at(top, self.row_ids, self.counts)
+
+        probs = self.counts / totals[self.row_ids]
+        entropy = np.bincount(self.row_ids, weights=-probs * np.log2(probs), minlength=len(self.rows))
+
+        return {value: {"count": int(totals[i]),
+                        "distinct": int(distinct[i]),
+                        "top": float(top[i] / totals[i]),
+                        "entropy": float(entropy[i])}
+                for i, value in enumerate(self.rows) if totals[i] > 0}
+
+    def todict(self) -> t.Dict[t.Tuple[t.Any, t.Any], int]:
+        """
+        return table as {(row, col): count}
+        :return:
+        """
+        return {(self.rows[i], self.cols[j]): int(c) for i, j, c in zip(self.row_ids, self.col_ids, self.counts)}
+
+
+def intern(values: t.List[t.Any]) -> t.Tuple[t.List[t.Any], np.ndarray]:
+    """
+    intern values: return vocabulary (in order of appearance) & value ids
+    :param values:
+    :return:
+    """
+    index = {}
+    ids = np.array([index.setdefault(value, len(index)) for value in values], dtype=np.int64)
+    return list(index.keys()), ids
+
+
+def connective_text(dialog: Dialog, relation: DiscourseRelation) -> t.Optional[str]:
+    """
+    connective string of a relation: conns for Implicit, lower-cased conn span tokens otherwise
+    :param dialog:
+    :param relation:
+    :return:
+    """
+    if relation.label == "Implicit":
+        return relation.conns
+    if not relation.conn:
+        return None
+    return " ".join([token for part in slice_sequence(dialog.tokens, relation.conn) for token in part]).lower()
+
+
+def relation_values(corpus: Corpus, level: int = SENSE_LEVEL) -> t.Dict[str, t.Tuple[t.List[t.Any], np.ndarray]]:
+    """
+    interned per-relation values for all DIMENSIONS (cached on corpus)
+    :param corpus:
+    :param level: sense level (senses kept as is in dialog.SENSE_STORE are reduced as well for lower levels)
+    :return:
+    """
+    def build():
+        parts = {doc_id: key for key, doc_ids in corpus.sets.items() for doc_id in doc_ids}
+        relations = [(d, r) for d in corpus.data.values() for r in d.relations or []]
+        store = [] if level < SENSE_LEVEL else None
+
+        values = {
+            "connective": [connective_text(d, r) for d, r in relations],
+            "conns": [r.conns for _, r in relations],
+            "sense": [reduce_sense(r.sense, level=level, store=store) for _, r in relations],
+            "label": [r.label for _, r in relations],
+            "part": [parts.get(d.doc_id) for d, _ in relations],
+            "doc_id": [d.doc_id for d, _ in relations],
+        }
+        return {key: intern(value) for key, value in values.items()}
+
+    return corpus.cached(("relation_values", level), build)
+
+
+def cooccurrence(corpus: Corpus,
+                 rows: str = "connective",
+                 cols: str = "sense",
+                 part: str = None,
+                 level: int = SENSE_LEVEL,
+                 labels: t.List[str] = None
+                 ) -> Contingency:
+    """
+    build (cached) contingency table of two relation dimensions
+    :param corpus:
+    :param rows: row dimension from DIMENSIONS
+    :param cols: column dimension from DIMENSIONS
+    :param part: split of data to count (all if None)
+    :param level: sense level
+    :param labels: relation types to count (all if None)
+    :return:
+    """
+    for dimension in [rows, cols]:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown Dimension: '{dimension}'")
+
+    if part and part not in corpus.sets:
+        raise ValueError(f"Unknown Corpus Part: {part}")
+
+    def build():
+        values = relation_values(corpus, level)
+        row_vocab, row_ids = values[rows]
+        col_vocab, col_ids = values[cols]
+
+        mask = np.ones(len(row_ids), dtype=bool)
+        if part:
+            part_vocab, part_ids = values["part"]
+            mask &= part_ids == part_vocab.index(part)
+        if labels:
+            label_vocab, label_ids = values["label"]
+            mask &= np.isin(label_ids, [label_vocab.index(x) for x in labels if x in label_vocab])
+
+        size = len(col_vocab)
+        cells = np.bincount(row_ids[mask] * size + col_ids[mask], minlength=len(row_vocab) * size)
+        nonzero = np.flatnonzero(cells)
+
+        return Contingency(row_vocab, col_vocab, nonzero // size, nonzero % size, cells[nonzero])
+
+    key = ("cooccurrence", rows, cols, part, level, tuple(labels) if labels else None)
+    return corpus.cached(key, build)
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="LUNA Discourse co-occurrence statistics", prog='PROG')
+
+    add_argument_group_io(parser)
+    add_argument_group_stats(parser)
+
+    return parser
+
+
+def add_argument_group_io(parser):
+    argument_group = parser.add_argument_group("I/O Arguments")
+    argument_group.add_argument('-d', '--data', required=True, help="path to data")
+    argument_group.add_argument('-p', '--part', required=False, help="split of data")
+
+
+def add_argument_group_stats(parser):
+    argument_group = parser.add_argument_group("Statistics Arguments")
+    argument_group.add_argument('-r', '--rows', default="connective", choices=DIMENSIONS, help="row dimension")
+    argument_group.add_argument('-c', '--cols', default="sense", choices=DIMENSIONS, help="column dimension")
+    argument_group.add_argument('-l', '--level', type=int, default=SENSE_LEVEL, help="sense level")
+    argument_group.add_argument('--labels', nargs='*', help="relation types to count")
+
+
+if __name__ == "__main__":
+    arg_parser = create_argument_parser()
+    args = arg_parser.parse_args()
+
+    table = cooccurrence(Corpus(args.data), args.rows, args.cols, args.part, args.level, args.labels)
+
+    for value, counts in sorted(table.ambiguity().items(), key=lambda x: -x[1]["count"]):
+        print(value, counts, table.row(value))
@@ -8,12 +8,17 @@ __version__ = "0.1.0"
 
 import typing as t
 
-from collections import defaultdict, Counter
+from collections import defaultdict
 
-from dialog import load
+from dialog import RELATION_TYPES, Dialog, load
+from patch import load_patched, find_patches
+
+if t.TYPE_CHECKING:
+    from frame import RelationFrame
 
 import os
 import argparse
+import threading
 
 
 DATA_DIRS = {"dev": "01", "trn": "02", "tst": "03"}
@@ -21,37 +26,125 @@ DATA_DIRS = {"dev": "01", "trn": "02", "tst": "03"}
 
 class Corpus:
 
-    def __init__(self, path: str, dirs: t.Dict[str, str] = None):
+    def __init__(self, path: str = None, dirs: t.Dict[str, str] = None, patches: t.Union[str, bool] = None):
         """
         init (load) dialogs from files
-        :param path:
+        :param path: path to data (empty corpus if None)
         :param dirs:
+        :param patches: path to patch file to apply at load time (see patch.py);
+            default: patches.json in data directory (if exists); False to load files as is
         """
         dirs = DATA_DIRS if dirs is None else dirs
 
-        data = {}
-        sets = defaultdict(list)
+        self.data = {}
+        self.sets = {}
+
+        self.version = 0  # bumped on every change; keys derived data caches
+        self._cache = {}
+        self._lock = threading.RLock()  # values are built once when shared between threads (e.g. server)
+
+        if path is None:
+            return
+
+        patches = find_patches(path, patches)
+
         for key, directory in dirs.items():
             files = read_dir(os.path.join(path, directory))
             for file_path in files:
-                dialog = load(os.path.join(path, directory, file_path))
-                data[dialog.doc_id] = dialog
-                sets[key].append(dialog.doc_id)
+                if patches:
+                    dialog = load_patched(os.path.join(path, directory, file_path), patches)
+                else:
+                    dialog = load(os.path.join(path, directory, file_path))
+                self.add(key, dialog)
 
-        self.data = data
-        self.sets = dict(sets)
+    def add(self, key: str, dialog: Dialog):
+        """
+        add dialog to corpus part
+        :param key: split of data
+        :param dialog:
+        :return:
+        """
+        self.data[dialog.doc_id] = dialog
+        self.sets.setdefault(key, []).append(dialog.doc_id)
+        self.touch()
+
+    def touch(self):
+        """
+        mark corpus as changed: call after modifying dialogs or relations in place to invalidate caches
+        :return:
+        """
+        self.version += 1
 
     @property
     def trn(self):
-        return [d for k, d in self.data.items() if k in self.sets.get("trn")]
+        return [d for k, d in self.data.items() if k in self.sets.get("trn", [])]
 
     @property
     def dev(self):
-        return [d for k, d in self.data.items() if k in self.sets.get("dev")]
+        return [d for k, d in self.data.items() if k in self.sets.get("dev", [])]
 
     @property
     def tst(self):
-        return [d for k, d in self.data.items() if k in self.sets.get("tst")]
+        return [d for k, d in self.data.items() if k in self.sets.get("tst", [])]
+
+    def cached(self, key: t.Hashable, build: t.Callable[[], t.Any]) -> t.Any:
+        """
+        return cached value for key, (re-)building it if corpus version has changed since it was built;
+        thread-safe: concurrent callers wait for a single build
+        :param key: cache key
+        :param build: function to compute value
+        :return:
+        """
+        with self._lock:
+            if key not in self._cache or self._cache[key][0] != self.version:
+                self._cache[key] = (self.version, build())
+            return self._cache[key][1]
+
+    def relations_frame(self, part: str = None) -> "RelationFrame":
+        """
+        columnar relation table (1 row per relation) either for whole data or part
+        :param part: split of data to get relations for
+        :return:
+        """
+        from frame import build_frame  # imported on demand: NumPy is not needed to load data
+
+        if part and part not in self.sets:
+            raise ValueError(f"Unknown Corpus Part: {part}")
+
+        parts = {doc_id: key for key, doc_ids in self.sets.items() for doc_id in doc_ids}
+        frame = self.cached("relations_frame", lambda: build_frame(list(self.data.values()), parts))
+
+        return frame.query(part=part) if part else frame
+
+    def shard(self, n: int, by: str = "tokens", stratify: bool = True) -> t.List[t.Dict[str, t.List[str]]]:
+        """
+        bin-pack dialogs into n shards of balanced work (greedy longest-first)
+        :param n: number of shards
+        :param by: work measure from Dialog.info: tokens, blocks, groups, relations
+        :param stratify: balance each split separately (otherwise all dialogs are packed together)
+        :return: list of shards as split to doc_ids dicts
+        """
+        if by not in ["tokens", "blocks", "groups", "relations"]:
+            raise ValueError(f"Unknown Work Measure: '{by}'")
+        if n < 1:
+            raise ValueError(f"Invalid Number of Shards: {n}")
+
+        parts = {doc_id: key for key, doc_ids in self.sets.items() for doc_id in doc_ids}
+        works = {doc_id: (self.data[doc_id].info.get(by) or 0) for doc_id in parts}
+
+        groups = list(self.sets.values()) if stratify else [list(parts.keys())]
+
+        shards = [defaultdict(list) for _ in range(n)]
+        totals = [0] * n
+        for doc_ids in groups:
+            loads = [0] * n
+            for doc_id in sorted(doc_ids, key=lambda x: (-works[x], x)):
+                i = min(range(n), key=lambda j: (loads[j], totals[j], j))
+                shards[i][parts[doc_id]].append(doc_id)
+                loads[i] += works[doc_id]
+                totals[i] += works[doc_id]
+
+        return [dict(shard) for shard in shards]
 
     def stats(self, part: str = None) -> t.Dict[str, t.Dict[str, int]]:
         """
@@ -66,11 +159,7 @@ class Corpus:
         else:
             data = list(self.data.values())
 
-        # label & sense tuples
-        paired = [[(r.label, r.sense) for r in d.relations] for d in data]
-        paired = [ref for dialog in paired for ref in dialog]
-
-        labels, senses = map(list, zip(*paired))
+        frame = self.relations_frame(part)
 
         info_list = [d.info for d in data]
 
@@ -80,12 +169,36 @@ class Corpus:
             "blocks": sum([x.get("blocks", 0) for x in info_list]),
             "groups": sum([x.get("groups", 0) for x in info_list]),
             "relations": sum([x.get("relations", 0) for x in info_list]),
-            "labels": dict(Counter(labels)),
-            "senses": dict(Counter(senses)),
-            "paired": dict(Counter(paired)),
+            "labels": frame.count("label"),
+            "senses": frame.count("sense"),
+            "paired": frame.count("label", "sense"),
         }
 
 
+def label_table(corpus: Corpus) -> str:
+    """
+    relation type distribution over corpus parts as markdown table (as in README)
+    :param corpus:
+    :return:
+    """
+    parts = [None] + [key for key in ["trn", "dev", "tst"] if key in corpus.sets]
+    counts = [corpus.relations_frame(part).count("label") for part in parts]
+    labels = [label for label in RELATION_TYPES if any(label in count for count in counts)]
+
+    header = ["Type"] + [(part or "all").upper() for part in parts]
+    rows = [[label] + [f"{count.get(label, 0):,}" for count in counts] for label in labels]
+
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    widths = widths[:1] + [max(widths[1:])] * len(widths[1:])
+
+    lines = ["| " + " | ".join([header[0].ljust(widths[0])] + [h.rjust(w) for h, w in zip(header[1:], widths[1:])]) + " |",
+             "|:" + "-" * widths[0] + "-|" + "|".join(["-" * (w + 1) + ":" for w in widths[1:]]) + "|"]
+    lines += ["| " + " | ".join([row[0].ljust(widths[0])] + [c.rjust(w) for c, w in zip(row[1:], widths[1:])]) + " |"
+              for row in rows]
+
+    return "\n".join(lines)
+
+
 def read_dir(path: str) -> t.List[str]:
     """
     read directory files
@@ -118,10 +231,17 @@ def create_argument_parser():
 def add_argument_group_io(parser):
     argument_group = parser.add_argument_group("I/O Arguments")
     argument_group.add_argument('-d', '--data', help="path to data")
+    argument_group.add_argument('-p', '--patches', help="path to patch file (default: patches.json in data)")
+    argument_group.add_argument('--no-patches', dest='patches', action='store_const', const=False,
+                                help="do not apply patches")
+    argument_group.add_argument('-s', '--stats', action='store_true', help="print relation type distribution")
 
 
 if __name__ == "__main__":
     arg_parser = create_argument_parser()
     args = arg_parser.parse_args()
 
-    corpus = Corpus(args.data)
+    corpus = Corpus(args.data, patches=args.patches)
+
+    if args.stats:
+        print(label_table(corpus))
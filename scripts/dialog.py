@@ -9,11 +9,10 @@ __version__ = "0.1.0"
 import typing as t
 import warnings as w
 
-import numpy as np
-
 from dataclasses import dataclass, asdict
 from collections import defaultdict
 
+import copy
 import json
 import argparse
 
@@ -235,8 +234,11 @@ def chunk_sequence(seq: t.List[int], step: int = 1) -> t.List[t.List[int]]:
     if len(seq) == 0:
         return []
 
-    if min(seq) - max(seq) + 1 == len(seq):
-        return [seq]
+    # contiguous sequence of unique ints: single chunk
+    if step == 1 and max(seq) - min(seq) + 1 == len(seq) == len(set(seq)):
+        return [sorted(seq)]
+
+    import numpy as np  # imported on demand: keeps module import fast
 
     seq = sorted(seq)
     chunks = np.split(np.array(seq), np.where(np.diff(seq) != step)[0] + 1)
@@ -254,6 +256,39 @@ def indices_to_span(indices: t.List[int]) -> Span:
     return slices
 
 
+def decode_spans(tags: t.Any, tag: t.Any = None) -> t.List[Span]:
+    """
+    batch convert token masks to spans in a single vectorized pass;
+    row-wise equivalent of indices_to_span on the indices of selected tokens
+    :param tags: 2-D boolean or tag array (relations x tokens)
+    :param tag: tag value to select (non-zero values if None)
+    :return: list of spans (one per row)
+    """
+    import numpy as np  # imported on demand: keeps module import fast
+
+    tags = np.asarray(tags)
+    if tags.ndim != 2:
+        raise ValueError(f"Invalid Tag Array Shape: {tags.shape}")
+
+    mask = tags.astype(bool) if tag is None else (tags == tag)
+    rows, size = mask.shape
+
+    # +1 where a slice begins, -1 where it ends (exclusive), w.r.t. token index
+    padded = np.zeros((rows, size + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+
+    b_rows, b_cols = np.nonzero(edges == 1)
+    _, e_cols = np.nonzero(edges == -1)
+
+    b_list = b_cols.tolist()
+    e_list = e_cols.tolist()
+    bounds = np.cumsum(np.bincount(b_rows, minlength=rows)).tolist()
+
+    slices = list(zip(b_list, e_list))
+    return [slices[b: e] for b, e in zip([0] + bounds[:-1], bounds)]
+
+
 # text & tokens
 def slice_text(span: Span, text: str) -> str:
     """
@@ -305,6 +340,22 @@ def align_span(span: Span, tokens: t.List[Slice]) -> Span:
 
 
 # sense decision
+def reduce_sense(sense: t.Optional[str], level: int = SENSE_LEVEL, store: t.List[str] = None) -> t.Optional[str]:
+    """
+    reduce sense to a level: 'Comparison.Concession.Epistemic concession' -> 'Comparison.Concession'
+    :param sense:
+    :param level: sense level to provide
+    :param store: list of senses to return as is
+    :return:
+    """
+    store = SENSE_STORE if store is None else store
+
+    if not sense or sense in store:
+        return sense
+
+    return ".".join(sense.split('.')[:level])
+
+
 def select_sense(senses: t.List[t.Dict[str, t.Union[None, t.List[str]]]],
                  conns: int = CONNS_INDEX,
                  sense: int = SENSE_INDEX,
@@ -356,18 +407,46 @@ def select_sense(senses: t.List[t.Dict[str, t.Union[None, t.List[str]]]],
             sense_text = sense_list[0] if len(sense_list) - 1 < sense_idx else sense_list[sense_idx]
 
             # reduce connective sense to a level
-            sense_text = ".".join(sense_text.split('.')[:sense_lvl]) if sense_text not in store else sense_text
+            sense_text = reduce_sense(sense_text, level=sense_lvl, store=store)
 
     return sense_text, conns_text
 
 
-def load(path: str) -> Dialog:
+def patch_data(data: t.Dict[str, t.Any], patches: t.List[t.Dict[str, t.Any]]) -> t.Dict[str, t.Any]:
     """
-    load a dialog from file
-    :param path: path to a dialog file
-    :return: dialog as a dict
+    apply declarative edits to dialog data (in-place):
+    {"relation": index (absolute: >= 0) or None (dialog field), "field": str, "value": new value}
+    :param data: dialog data as loaded from file
+    :param patches: list of edits
+    :return: patched data
+    """
+    for patch in patches:
+        index = patch.get("relation")
+        field = patch.get("field")
+
+        if index is None:
+            target = data
+        else:
+            relations = data.get("relations", [])
+            if type(index) is not int or not 0 <= index < len(relations):
+                raise ValueError(f"Invalid Relation Index: {index} in {data.get('doc_id')}")
+            target = relations[index]
+
+        if field not in target:
+            raise ValueError(f"Unknown Field: '{field}' in {data.get('doc_id')}")
+
+        # copy: patches are cached & shared between loads
+        target[field] = copy.deepcopy(patch.get("value"))
+
+    return data
+
+
+def from_dict(data: t.Dict[str, t.Any]) -> Dialog:
+    """
+    create a dialog from dict (as in file)
+    :param data: dialog data
+    :return:
     """
-    data = json.load(open(path, 'r'))
     return Dialog(
         doc_id=data.get("doc_id"),
         tokens=data.get("tokens"),
@@ -377,6 +456,17 @@ def load(path: str) -> Dialog:
     )
 
 
+def load(path: str, patches: t.List[t.Dict[str, t.Any]] = None) -> Dialog:
+    """
+    load a dialog from file
+    :param path: path to a dialog file
+    :param patches: edits to apply to loaded data (see patch_data)
+    :return:
+    """
+    data = json.load(open(path, 'r'))
+    return from_dict(patch_data(data, patches) if patches else data)
+
+
 def create_argument_parser():
     parser = argparse.ArgumentParser(description="LUNA Discourse Reader", prog='PROG')
 
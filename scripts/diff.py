@@ -0,0 +1,256 @@
+""" Content-Hash Diff between two versions of LUNA Discourse Data """
+
+__author__ = "Evgeny A. Stepanov"
+__email__ = "stepanov.evgeny.a@gmail.com"
+__status__ = "dev"
+__version__ = "0.1.0"
+
+
+import typing as t
+
+from dialog import Dialog, DiscourseRelation
+from dialog import load, expand_span, indices_to_span
+from corpus import DATA_DIRS, read_dir
+from patch import find_patches, load_patched, stamp
+
+import os
+import json
+import hashlib
+import argparse
+
+
+FINGERPRINT_FILE = ".fingerprints.json"
+FINGERPRINT_VERSION = 1
+
+LABEL_FIELDS = ["label", "sense", "conns"]
+SPAN_FIELDS = ["conn", "arg1", "arg2", "sup1", "sup2"]
+
+# minimum number of equal fields for a pair of relations to be reported as modified (vs. added & removed)
+MATCH_FIELDS = 4
+
+
+def digest(data: t.Any) -> str:
+    """
+    stable hash of JSON-serializable data
+    :param data:
+    :return:
+    """
+    return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def relation_fingerprint(relation: DiscourseRelation) -> str:
+    """
+    stable hash of relation labels & (sanitized) spans
+    :param relation:
+    :return:
+    """
+    labels = [getattr(relation, field) for field in LABEL_FIELDS]
+    spans = [[list(part) for part in getattr(relation, field)] for field in SPAN_FIELDS]
+    return digest(labels + spans)
+
+
+def dialog_fingerprint(dialog: Dialog) -> t.Dict[str, t.Any]:
+    """
+    stable hashes of dialog: content (tokens, blocks, groups), relations & whole dialog
+    :param dialog:
+    :return:
+    """
+    content = digest([dialog.tokens, dialog.blocks, dialog.groups])
+    relations = [relation_fingerprint(relation) for relation in dialog.relations or []]
+    return {
+        "doc_id": dialog.doc_id,
+        "dialog": digest([dialog.doc_id, content, relations]),
+        "content": content,
+        "relations": relations,
+    }
+
+
+def load_dialog(path: str, patches: t.Optional[str]) -> Dialog:
+    return load_patched(path, patches) if patches else load(path)
+
+
+def fingerprint_tree(path: str,
+                     dirs: t.Dict[str, str] = None,
+                     cache: bool = True,
+                     patches: t.Union[str, bool] = None
+                     ) -> t.Dict[str, t.Dict[str, t.Any]]:
+    """
+    fingerprint all dialogs in data tree; fingerprints are cached next to the data (FINGERPRINT_FILE)
+    & recomputed only for files whose modification time or size has changed (all, if patch file has changed)
+    :param path: path to data
+    :param dirs:
+    :param cache: read & write fingerprint cache
+    :param patches: patch file to apply (as Corpus: default patches.json in data, False to disable)
+    :return: fingerprints by doc_id (with relative file path)
+    """
+    dirs = DATA_DIRS if dirs is None else dirs
+    patches = find_patches(path, patches)
+    patch_stamp = [os.path.abspath(patches), *stamp(patches)] if patches else None
+
+    cache_path = os.path.join(path, FINGERPRINT_FILE)
+    entries = {}
+    if cache and os.path.isfile(cache_path):
+        stored = json.load(open(cache_path, 'r'))
+        if stored.get("version") == FINGERPRINT_VERSION and stored.get("patches") == patch_stamp:
+            entries = stored.get("files", {})
+
+    changed = False
+    files = {}
+    for directory in dirs.values():
+        for file_name in read_dir(os.path.join(path, directory)):
+            file_path = os.path.join(directory, file_name)
+            file_stamp = list(stamp(os.path.join(path, file_path)))
+
+            entry = entries.get(file_path)
+            if entry is None or entry.get("stamp") != file_stamp:
+                entry = {"stamp": file_stamp, **dialog_fingerprint(load_dialog(os.path.join(path, file_path), patches))}
+                changed = True
+
+            files[file_path] = entry
+
+    if cache and (changed or set(files) != set(entries)):
+        json.dump({"version": FINGERPRINT_VERSION, "patches": patch_stamp, "files": files},
+                  open(cache_path, 'w'), indent=1)
+
+    return {entry.get("doc_id"): {**entry, "file": file_path} for file_path, entry in files.items()}
+
+
+def span_delta(old: t.List[t.Tuple[int, int]], new: t.List[t.Tuple[int, int]]) -> t.Dict[str, t.List]:
+    """
+    token-level difference of spans
+    :param old:
+    :param new:
+    :return: added & removed slices
+    """
+    old_ids = set(expand_span(old))
+    new_ids = set(expand_span(new))
+    return {
+        "added": indices_to_span(sorted(new_ids - old_ids)),
+        "removed": indices_to_span(sorted(old_ids - new_ids)),
+    }
+
+
+def relation_delta(old: DiscourseRelation, new: DiscourseRelation) -> t.Dict[str, t.Dict[str, t.Any]]:
+    """
+    per-field difference of relations (changed fields only)
+    :param old:
+    :param new:
+    :return:
+    """
+    delta = {}
+    for field in LABEL_FIELDS:
+        if getattr(old, field) != getattr(new, field):
+            delta[field] = {"old": getattr(old, field), "new": getattr(new, field)}
+    for field in SPAN_FIELDS:
+        if getattr(old, field) != getattr(new, field):
+            delta[field] = span_delta(getattr(old, field), getattr(new, field))
+    return delta
+
+
+def diff_dialog(old: Dialog, new: Dialog) -> t.Dict[str, t.Any]:
+    """
+    diff two versions of a dialog: unchanged relations are matched by fingerprint,
+    the rest is paired greedily by the number of equal fields
+    :param old:
+    :param new:
+    :return:
+    """
+    old_prints = [relation_fingerprint(r) for r in old.relations or []]
+    new_prints = [relation_fingerprint(r) for r in new.relations or []]
+
+    # match identical relations
+    unmatched = {}
+    for i, fingerprint in enumerate(old_prints):
+        unmatched.setdefault(fingerprint, []).append(i)
+
+    old_rest = set(range(len(old_prints)))
+    new_rest = []
+    for j, fingerprint in enumerate(new_prints):
+        if unmatched.get(fingerprint):
+            old_rest.discard(unmatched[fingerprint].pop(0))
+        else:
+            new_rest.append(j)
+
+    # pair modified relations
+    def score(i: int, j: int) -> int:
+        a, b = old.relations[i], new.relations[j]
+        return sum([getattr(a, f) == getattr(b, f) for f in LABEL_FIELDS + SPAN_FIELDS])
+
+    pairs = sorted([(score(i, j), i, j) for i in old_rest for j in new_rest], key=lambda x: (-x[0], x[1], x[2]))
+
+    modified = []
+    paired_old, paired_new = set(), set()
+    for value, i, j in pairs:
+        if value < MATCH_FIELDS or i in paired_old or j in paired_new:
+            continue
+        paired_old.add(i)
+        paired_new.add(j)
+        modified.append({"old": i, "new": j, "fields": relation_delta(old.relations[i], new.relations[j])})
+
+    return {
+        "content": [old.tokens, old.blocks, old.groups] != [new.tokens, new.blocks, new.groups],
+        "added": sorted(set(new_rest) - paired_new),
+        "removed": sorted(old_rest - paired_old),
+        "modified": sorted(modified, key=lambda x: x.get("new")),
+    }
+
+
+def diff_corpus(old_path: str,
+                new_path: str,
+                dirs: t.Dict[str, str] = None,
+                cache: bool = True,
+                patches: t.Union[str, bool] = None
+                ) -> t.Dict[str, t.Any]:
+    """
+    diff two versions of data; dialogs with identical fingerprints are skipped without loading
+    :param old_path: path to old data
+    :param new_path: path to new data
+    :param dirs:
+    :param cache: use fingerprint caches
+    :param patches: patch file to apply to both versions (default: patches.json in each data, False to disable)
+    :return:
+    """
+    old_patches, new_patches = find_patches(old_path, patches), find_patches(new_path, patches)
+
+    old_prints = fingerprint_tree(old_path, dirs, cache=cache, patches=old_patches or False)
+    new_prints = fingerprint_tree(new_path, dirs, cache=cache, patches=new_patches or False)
+
+    modified = {}
+    for doc_id in sorted(set(old_prints) & set(new_prints)):
+        old_entry, new_entry = old_prints[doc_id], new_prints[doc_id]
+        if old_entry.get("dialog") == new_entry.get("dialog"):
+            continue
+        modified[doc_id] = diff_dialog(load_dialog(os.path.join(old_path, old_entry.get("file")), old_patches),
+                                       load_dialog(os.path.join(new_path, new_entry.get("file")), new_patches))
+
+    return {
+        "added": sorted(set(new_prints) - set(old_prints)),
+        "removed": sorted(set(old_prints) - set(new_prints)),
+        "modified": modified,
+    }
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="LUNA Discourse data diff", prog='PROG')
+
+    add_argument_group_io(parser)
+
+    return parser
+
+
+def add_argument_group_io(parser):
+    argument_group = parser.add_argument_group("I/O Arguments")
+    argument_group.add_argument('-a', '--old', required=True, help="path to old data")
+    argument_group.add_argument('-b', '--new', required=True, help="path to new data")
+    argument_group.add_argument('--no-cache', dest='cache', action='store_false', help="do not use fingerprint cache")
+    argument_group.add_argument('-p', '--patches', required=False,
+                                help="path to patch file (default: patches.json in each data)")
+    argument_group.add_argument('--no-patches', dest='patches', action='store_const', const=False,
+                                help="do not apply patches")
+
+
+if __name__ == "__main__":
+    arg_parser = create_argument_parser()
+    args = arg_parser.parse_args()
+
+    print(json.dumps(diff_corpus(args.old, args.new, cache=args.cache, patches=args.patches), indent=2, ensure_ascii=False))
@@ -0,0 +1,219 @@
+""" Columnar Relation Table for LUNA Discourse Data """
+
+__author__ = "Evgeny A. Stepanov"
+__email__ = "stepanov.evgeny.a@gmail.com"
+__status__ = "dev"
+__version__ = "0.1.0"
+
+
+import typing as t
+
+import numpy as np
+
+from collections import Counter
+
+from dialog import RELATION_TYPES, Dialog
+
+
+SPAN_ROLES = ["conn", "arg1", "arg2", "sup1", "sup2"]
+
+# per role columns: <role>_<suffix>
+ROLE_COLUMNS = ["slices", "tokens", "min", "max", "blocks", "groups"]
+
+# query operators: <column>__<operator>=<value>
+OPERATORS = {
+    "eq": np.equal,
+    "ne": np.not_equal,
+    "gt": np.greater,
+    "ge": np.greater_equal,
+    "lt": np.less,
+    "le": np.less_equal,
+    "in": lambda column, value: np.isin(column, list(value)),
+}
+
+
+class RelationFrame:
+
+    def __init__(self, columns: t.Dict[str, np.ndarray], labels: t.List[str], senses: t.List[str]):
+        """
+        columnar relation table: 1 row per relation
+        :param columns: equal length column arrays
+        :param labels: label vocabulary (label column holds indices)
+        :param senses: sense vocabulary (sense column holds indices, -1 for no sense)
+        """
+        if len({len(column) for column in columns.values()}) > 1:
+            raise ValueError(f"Columns have different lengths: { {k: len(v) for k, v in columns.items()} }")
+
+        self.columns = columns
+        self.labels = labels
+        self.senses = senses
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, key: t.Union[str, np.ndarray]) -> t.Union[np.ndarray, "RelationFrame"]:
+        if isinstance(key, str):
+            return self.columns[key]
+        return self.filter(key)
+
+    def filter(self, mask: np.ndarray) -> "RelationFrame":
+        """
+        select rows w.r.t. boolean mask (or indices)
+        :param mask:
+        :return:
+        """
+        return RelationFrame({k: v[mask] for k, v in self.columns.items()}, self.labels, self.senses)
+
+    def encode(self, column: str, value: t.Any) -> t.Any:
+        """
+        convert label & sense strings to column ids
+        :param column:
+        :param value:
+        :return:
+        """
+        if isinstance(value, (list, tuple, set)):
+            return [self.encode(column, v) for v in value]
+        if column == "label" and isinstance(value, str):
+            return self.labels.index(value) if value in self.labels else -2
+        if column == "sense" and (isinstance(value, str) or value is None):
+            return self.senses.index(value) if value in self.senses else -1 if value is None else -2
+        return value
+
+    def decode(self, column: str, value: t.Any) -> t.Any:
+        """
+        convert label & sense ids to strings
+        :param column:
+        :param value:
+        :return:
+        """
+        if column == "label":
+            return self.labels[value]
+        if column == "sense":
+            return None if value < 0 else self.senses[value]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def mask(self, **conditions) -> np.ndarray:
+        """
+        boolean row mask for conditions as <column>[__<operator>]=<value>; e.g. arg1_blocks__gt=1
+        :param conditions:
+        :return:
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for key, value in conditions.items():
+            column, _, operator = key.partition("__")
+            operator = operator or "eq"
+
+            if column not in self.columns:
+                raise ValueError(f"Unknown Column: '{column}'")
+            if operator not in OPERATORS:
+                raise ValueError(f"Unknown Operator: '{operator}'")
+
+            mask &= OPERATORS[operator](self.columns[column], self.encode(column, value))
+        return mask
+
+    def query(self, **conditions) -> "RelationFrame":
+        """
+        select rows satisfying all the conditions (see mask)
+        :param conditions:
+        :return:
+        """
+        return self.filter(self.mask(**conditions))
+
+    def count(self, *columns: str) -> t.Dict[t.Any, int]:
+        """
+        group-by counts; keys are values for a single column & tuples for several
+        :param columns:
+        :return:
+        """
+        if not columns:
+            raise ValueError("No columns to count")
+
+        arrays = [self.columns[column] for column in columns]
+
+        if all(array.dtype.kind in "iub" for array in arrays):
+            if len(self) == 0:
+                return {}
+            keys, counts = np.unique(np.stack(arrays, axis=1), axis=0, return_counts=True)
+            keys = [tuple(self.decode(c, v) for c, v in zip(columns, key)) for key in keys]
+            counts = counts.tolist()
+        else:
+            paired = Counter(zip(*arrays))
+            keys = [tuple(self.decode(c, v) for c, v in zip(columns, key)) for key in paired.keys()]
+            counts = list(paired.values())
+
+        return {(key[0] if len(columns) == 1 else key): count for key, count in zip(keys, counts)}
+
+    def rows(self) -> t.List[t.Dict[str, t.Any]]:
+        """
+        return table as a list of row dicts (decoded)
+        :return:
+        """
+        names = list(self.columns.keys())
+        return [{k: self.decode(k, v) for k, v in zip(names, row)} for row in zip(*self.columns.values())]
+
+
+def token_index(slices: t.List[t.Tuple[int, int]]) -> np.ndarray:
+    """
+    begin indices of consecutive slices (blocks or groups) for token lookup
+    :param slices:
+    :return:
+    """
+    return np.array([b for b, _ in slices or []], dtype=np.int64)
+
+
+def count_crossing(span: t.List[t.Tuple[int, int]], begins: np.ndarray) -> int:
+    """
+    number of distinct slices (blocks or groups) a span touches
+    :param span:
+    :param begins: slice begin indices
+    :return:
+    """
+    if not span or not begins.size:
+        return 0
+    bounds = np.array(span, dtype=np.int64)
+    first = np.searchsorted(begins, bounds[:, 0], side="right") - 1
+    final = np.searchsorted(begins, bounds[:, 1] - 1, side="right") - 1
+    return len({i for b, e in zip(first.tolist(), final.tolist()) for i in range(b, e + 1)})
+
+
+def build_frame(dialogs: t.List[Dialog], parts: t.Dict[str, str] = None) -> RelationFrame:
+    """
+    build columnar relation table from dialogs
+    :param dialogs:
+    :param parts: doc_id to split mapping
+    :return:
+    """
+    parts = parts or {}
+    relations = [(d, i, r) for d in dialogs for i, r in enumerate(d.relations or [])]
+
+    senses = sorted({r.sense for _, _, r in relations if r.sense})
+
+    columns = {
+        "doc_id": np.array([d.doc_id for d, _, _ in relations], dtype=object),
+        "part": np.array([parts.get(d.doc_id) for d, _, _ in relations], dtype=object),
+        "index": np.array([i for _, i, _ in relations], dtype=np.int64),
+        "label": np.array([RELATION_TYPES.index(r.label) for _, _, r in relations], dtype=np.int64),
+        "sense": np.array([senses.index(r.sense) if r.sense else -1 for _, _, r in relations], dtype=np.int64),
+        "conns": np.array([r.conns for _, _, r in relations], dtype=object),
+    }
+
+    values = {f"{role}_{suffix}": [] for role in SPAN_ROLES for suffix in ROLE_COLUMNS}
+
+    index = {}
+    for dialog, _, relation in relations:
+        if dialog.doc_id not in index:
+            index[dialog.doc_id] = (token_index(dialog.blocks), token_index(dialog.groups))
+        blocks, groups = index[dialog.doc_id]
+
+        for role in SPAN_ROLES:
+            span = getattr(relation, role)
+            values[f"{role}_slices"].append(len(span))
+            values[f"{role}_tokens"].append(sum([e - b for b, e in span]))
+            values[f"{role}_min"].append(min([b for b, _ in span]) if span else -1)
+            values[f"{role}_max"].append(max([e for _, e in span]) if span else -1)
+            values[f"{role}_blocks"].append(count_crossing(span, blocks))
+            values[f"{role}_groups"].append(count_crossing(span, groups))
+
+    columns.update({k: np.array(v, dtype=np.int64) for k, v in values.items()})
+
+    return RelationFrame(columns, list(RELATION_TYPES), senses)
@@ -0,0 +1,423 @@
+""" Batched & Padded Data Loader for LUNA Discourse Corpus """
+
+__author__ = "Evgeny A. Stepanov"
+__email__ = "stepanov.evgeny.a@gmail.com"
+__status__ = "dev"
+__version__ = "0.1.0"
+
+
+import typing as t
+
+import numpy as np
+
+from dataclasses import dataclass
+from collections import Counter
+
+from dialog import RELATION_TYPES, Slice, Span, Dialog, DiscourseRelation
+from dialog import decode_spans
+from corpus import Corpus
+
+import queue
+import threading
+import argparse
+
+
+ROLE_TAGS = ["O", "conn", "arg1", "arg2", "sup1", "sup2"]
+WINDOW_UNITS = ["dialog", "relation"]
+
+PAD_TOKEN = "<PAD>"
+UNK_TOKEN = "<UNK>"
+
+
+@dataclass
+class Window:
+    doc_id: str
+    index: t.Optional[int]  # relation index within dialog (None for dialog windows)
+    offset: int  # index of the first window token within dialog
+    # token-level arrays
+    tokens: np.ndarray  # token ids
+    blocks: np.ndarray  # block ids (relative to the first block of the window)
+    groups: np.ndarray  # group ids (relative to the first group of the window)
+    roles: np.ndarray  # role tag ids from ROLE_TAGS
+    # relation-level labels
+    label: int = -1
+    sense: int = -1
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+def build_vocab(dialogs: t.List[Dialog], min_count: int = 1) -> t.Dict[str, int]:
+    """
+    build token vocabulary from dialogs; PAD & UNK tokens are always 0 & 1
+    :param dialogs:
+    :param min_count: minimum token frequency to be included
+    :return:
+    """
+    counts = Counter([token for dialog in dialogs for token in dialog.tokens])
+    tokens = sorted([token for token, count in counts.items() if count >= min_count])
+    return {token: i for i, token in enumerate([PAD_TOKEN, UNK_TOKEN] + tokens)}
+
+
+def index_slices(slices: t.List[Slice], size: int) -> np.ndarray:
+    """
+    map each token to the index of the slice it belongs to (-1 if none)
+    :param slices:
+    :param size: number of tokens
+    :return:
+    """
+    ids = np.full(size, -1, dtype=np.int64)
+    for i, (b, e) in enumerate(slices or []):
+        ids[b:e] = i
+    return ids
+
+
+def role_array(relations: t.List[DiscourseRelation], size: int) -> np.ndarray:
+    """
+    tag each token with its role id; on overlap the first relation & the first role of ROLE_TAGS win
+    :param relations:
+    :param size: number of tokens
+    :return:
+    """
+    roles = np.zeros(size, dtype=np.int64)
+    for relation in reversed(relations):
+        for tag in reversed(range(1, len(ROLE_TAGS))):
+            for b, e in getattr(relation, ROLE_TAGS[tag]):
+                roles[b:e] = tag
+    return roles
+
+
+def relation_window(relation: DiscourseRelation, size: int, context: int = 0) -> Slice:
+    """
+    compute relation window from its arguments' spans extended by context tokens
+    :param relation:
+    :param size: number of dialog tokens
+    :param context: number of tokens to add on each side
+    :return:
+    """
+    span = relation.arg1 + relation.arg2
+    if not span:
+        span = relation.conn + relation.sup1 + relation.sup2
+
+    if not span:
+        return 0, 0
+
+    bos = min([b for b, _ in span])
+    eos = max([e for _, e in span])
+
+    return max(0, bos - context), min(size, eos + context)
+
+
+def make_windows(dialog: Dialog,
+                 vocab: t.Dict[str, int],
+                 senses: t.Dict[str, int],
+                 unit: str = "relation",
+                 context: int = 0
+                 ) -> t.List[Window]:
+    """
+    precompute dialog or relation windows for a dialog
+    :param dialog:
+    :param vocab: token vocabulary
+    :param senses: sense vocabulary
+    :param unit: window unit from WINDOW_UNITS
+    :param context: number of context tokens around relation arguments
+    :return:
+    """
+    if unit not in WINDOW_UNITS:
+        raise ValueError(f"Unknown Window Unit: '{unit}'")
+
+    size = len(dialog.tokens)
+    relations = dialog.relations or []
+
+    unk = vocab.get(UNK_TOKEN)
+    tokens = np.array([vocab.get(token, unk) for token in dialog.tokens], dtype=np.int64)
+    blocks = index_slices(dialog.blocks, size)
+    groups = index_slices(dialog.groups, size)
+
+    def relative(ids: np.ndarray) -> np.ndarray:
+        valid = ids[ids >= 0]
+        return np.where(ids >= 0, ids - (valid.min() if valid.size else 0), -1)
+
+    if unit == "dialog":
+        return [Window(dialog.doc_id, None, 0, tokens, blocks, groups, role_array(relations, size))]
+
+    windows = []
+    for i, relation in enumerate(relations):
+        bos, eos = relation_window(relation, size, context)
+        windows.append(Window(
+            doc_id=dialog.doc_id,
+            index=i,
+            offset=bos,
+            tokens=tokens[bos:eos],
+            blocks=relative(blocks[bos:eos]),
+            groups=relative(groups[bos:eos]),
+            roles=role_array([relation], size)[bos:eos],
+            label=RELATION_TYPES.index(relation.label),
+            sense=senses.get(relation.sense, -1)
+        ))
+    return windows
+
+
+def pad_batch(windows: t.List[Window]) -> t.Dict[str, t.Any]:
+    """
+    pad windows to the longest one & stack into arrays
+    :param windows:
+    :return:
+    """
+    lengths = np.array([len(window) for window in windows], dtype=np.int64)
+    shape = (len(windows), int(lengths.max()) if len(windows) else 0)
+
+    batch = {
+        "tokens": np.zeros(shape, dtype=np.int64),  # PAD token id
+        "blocks": np.full(shape, -1, dtype=np.int64),
+        "groups": np.full(shape, -1, dtype=np.int64),
+        "roles": np.zeros(shape, dtype=np.int64),
+        "mask": np.zeros(shape, dtype=bool),
+    }
+
+    for i, window in enumerate(windows):
+        n = len(window)
+        batch["tokens"][i, :n] = window.tokens
+        batch["blocks"][i, :n] = window.blocks
+        batch["groups"][i, :n] = window.groups
+        batch["roles"][i, :n] = window.roles
+        batch["mask"][i, :n] = True
+
+    batch["lengths"] = lengths
+    batch["label"] = np.array([window.label for window in windows], dtype=np.int64)
+    batch["sense"] = np.array([window.sense for window in windows], dtype=np.int64)
+    batch["doc_id"] = [window.doc_id for window in windows]
+    batch["index"] = [window.index for window in windows]
+    batch["offset"] = np.array([window.offset for window in windows], dtype=np.int64)
+
+    return batch
+
+
+def decode_batch(roles: np.ndarray, offsets: np.ndarray = None) -> t.List[t.Dict[str, Span]]:
+    """
+    decode (predicted) role tags of a batch to relation spans w.r.t. dialog tokens
+    :param roles: role tag ids (windows x tokens), padding is "O"
+    :param offsets: window offsets within dialogs (batch "offset")
+    :return: list of role to span dicts
+    """
+    offsets = np.zeros(len(roles), dtype=np.int64) if offsets is None else offsets
+
+    decoded = [decode_spans(roles, tag=tag) for tag in range(1, len(ROLE_TAGS))]
+
+    return [{ROLE_TAGS[tag]: [(b + offset, e + offset) for b, e in spans[i]]
+             for tag, spans in enumerate(decoded, start=1)}
+            for i, offset in enumerate(np.asarray(offsets).tolist())]
+
+
+class DataLoader:
+
+    def __init__(self,
+                 corpus: Corpus,
+                 part: str = None,
+                 unit: str = "relation",
+                 vocab: t.Dict[str, int] = None,
+                 batch_size: int = 32,
+                 shuffle: bool = True,
+                 bucket: int = 10,
+                 context: int = 0,
+                 prefetch: int = 0,
+                 seed: int = None):
+        """
+        batched data loader over corpus (part); windows are precomputed once & cached across epochs
+        until the corpus version changes: dialogs added with Corpus.add are picked up automatically,
+        in-place edits of dialogs or relations are not -- call Corpus.touch after them
+        :param corpus:
+        :param part: split of data to load (all if None)
+        :param unit: window unit from WINDOW_UNITS
+        :param vocab: token vocabulary (built from part on first use & kept if None, see reset_vocab;
+            pass training vocabulary for dev & tst)
+        :param batch_size:
+        :param shuffle: shuffle & length-bucket windows every epoch
+        :param bucket: number of batches per length bucket
+        :param context: number of context tokens around relation arguments
+        :param prefetch: number of batches to prepare in a background thread (0 to disable)
+        :param seed: random seed for shuffling
+        """
+        if part and part not in corpus.sets:
+            raise ValueError(f"Unknown Corpus Part: {part}")
+
+        if unit not in WINDOW_UNITS:
+            raise ValueError(f"Unknown Window Unit: '{unit}'")
+
+        self.corpus = corpus
+        self.part = part
+        self.unit = unit
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket = bucket
+        self.context = context
+        self.prefetch = prefetch
+
+        self.rng = np.random.default_rng(seed)
+
+        self._vocab = vocab
+        self._cache = None  # (corpus version, vocab, senses, windows)
+
+    @property
+    def dialogs(self) -> t.List[Dialog]:
+        return getattr(self.corpus, self.part) if self.part else list(self.corpus.data.values())
+
+    def _prepare(self) -> t.Tuple[t.Dict[str, int], t.Dict[str, int], t.List[Window]]:
+        """
+        (re-)compute windows if corpus has changed since the last call
+        :return:
+        """
+        version = self.corpus.version
+
+        if self._cache is None or self._cache[0] != version:
+            dialogs = self.dialogs
+
+            # token ids must not change between epochs: vocabulary is frozen on first build
+            if self._vocab is None:
+                self._vocab = build_vocab(dialogs)
+            vocab = self._vocab
+
+            # senses are indexed over the whole corpus to be consistent across parts
+            senses = sorted({r.sense for d in self.corpus.data.values() for r in d.relations if r.sense})
+            senses = {sense: i for i, sense in enumerate(senses)}
+
+            windows = [w for d in dialogs for w in make_windows(d, vocab, senses, self.unit, self.context)]
+            self._cache = (version, vocab, senses, windows)
+
+        return self._cache[1:]
+
+    def reset_vocab(self):
+        """
+        drop built vocabulary: rebuilt from current data on next use (token ids change)
+        :return:
+        """
+        self._vocab = None
+        self._cache = None
+
+    @property
+    def vocab(self) -> t.Dict[str, int]:
+        return self._prepare()[0]
+
+    @property
+    def senses(self) -> t.Dict[str, int]:
+        return self._prepare()[1]
+
+    @property
+    def windows(self) -> t.List[Window]:
+        return self._prepare()[2]
+
+    def batches(self) -> t.List[t.List[int]]:
+        """
+        split window indices into batches for an epoch
+        :return:
+        """
+        windows = self.windows
+        size = self.batch_size
+
+        if not self.shuffle:
+            indices = list(range(len(windows)))
+            return [indices[i: i + size] for i in range(0, len(indices), size)]
+
+        lengths = np.array([len(window) for window in windows])
+        indices = self.rng.permutation(len(windows))
+
+        # sort by length within buckets, so that batches have similar lengths
+        batches = []
+        step = size * max(1, self.bucket)
+        for i in range(0, len(indices), step):
+            pool = indices[i: i + step]
+            pool = pool[np.argsort(lengths[pool], kind="stable")].tolist()
+            batches.extend([pool[j: j + size] for j in range(0, len(pool), size)])
+
+        return [batches[i] for i in self.rng.permutation(len(batches))]
+
+    def __len__(self):
+        return -(-len(self.windows) // self.batch_size)
+
+    def __iter__(self) -> t.Iterator[t.Dict[str, t.Any]]:
+        windows = self.windows
+        batches = (pad_batch([windows[i] for i in batch]) for batch in self.batches())
+
+        if self.prefetch > 0:
+            return prefetch(batches, self.prefetch)
+
+        return batches
+
+
+def prefetch(iterable: t.Iterable, size: int, timeout: float = 0.1) -> t.Iterator:
+    """
+    consume iterable in a background thread, keeping up to size items ready;
+    the thread stops once the consumer stops iterating (generator is closed)
+    :param iterable:
+    :param size: queue size
+    :param timeout: interval (seconds) for the worker to check for stop
+    :return:
+    """
+    done = object()
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=timeout)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as error:
+            put(error)
+        put(done)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="LUNA Discourse Data Loader", prog='PROG')
+
+    add_argument_group_io(parser)
+    add_argument_group_loader(parser)
+
+    return parser
+
+
+def add_argument_group_io(parser):
+    argument_group = parser.add_argument_group("I/O Arguments")
+    argument_group.add_argument('-d', '--data', required=True, help="path to data")
+    argument_group.add_argument('-p', '--part', required=False, help="split of data to load")
+
+
+def add_argument_group_loader(parser):
+    argument_group = parser.add_argument_group("Loader Arguments")
+    argument_group.add_argument('-u', '--unit', default="relation", choices=WINDOW_UNITS, help="window unit")
+    argument_group.add_argument('-b', '--batch_size', type=int, default=32, help="batch size")
+    argument_group.add_argument('-c', '--context', type=int, default=0, help="window context size")
+    argument_group.add_argument('--prefetch', type=int, default=0, help="number of batches to prefetch")
+
+
+if __name__ == "__main__":
+    arg_parser = create_argument_parser()
+    args = arg_parser.parse_args()
+
+    loader = DataLoader(Corpus(args.data), part=args.part, unit=args.unit,
+                        batch_size=args.batch_size, context=args.context, prefetch=args.prefetch)
+
+    print({"windows": len(loader.windows), "batches": len(loader), "vocab": len(loader.vocab)})
@@ -1,18 +1,130 @@
-""" apply fixes to loaded dialog """
+""" apply fixes to loaded dialogs: declarative patch overlay """
 
-from dialog import load
+import typing as t
 
+from dialog import Dialog, load, from_dict, patch_data
 
-def fix_0704000020():
-    # Token 410 has roles: ['conn', 'arg2'] in Explicit relation
-    # last relation --> reduce arg2 span to start from 411
-    sec = 'data/02'
-    did = '0704000020'
+import os
+import json
+import argparse
 
-    dialog = load(f"{sec}/{did}.json")
-    dialog.relations[-1].arg2 = [(411, 414)]
-    dialog.dump(f"{sec}/{did}.json")
+
+# patch file: list of {"doc_id": str, "relation": int (>= 0) or null, "field": str, "value": any, "note": str}
+# applied by default when found in data directory
+PATCH_NAME = "patches.json"
+PATCH_FILE = os.path.join("data", PATCH_NAME)
+
+# parsed patch files: path -> (file stamp, patches by doc_id)
+PATCHES_CACHE = {}
+
+
+def stamp(path: str) -> t.Tuple[int, int]:
+    """
+    file modification stamp for cache invalidation
+    :param path:
+    :return:
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def find_patches(path: str, patches: t.Union[str, bool] = None) -> t.Optional[str]:
+    """
+    resolve patch file for data: None -> PATCH_NAME in data directory (if exists), False -> no patches
+    :param path: path to data
+    :param patches: path to patch file, None (default) or False (disabled)
+    :return: path to patch file or None
+    """
+    if patches is False:
+        return None
+    if patches:
+        return patches
+    default = os.path.join(path, PATCH_NAME)
+    return default if os.path.isfile(default) else None
+
+
+def read_patches(path: str = PATCH_FILE) -> t.Dict[str, t.List[t.Dict[str, t.Any]]]:
+    """
+    read patch file & index edits by doc_id; cached until the file changes
+    :param path:
+    :return:
+    """
+    file_stamp = stamp(path)
+    if path not in PATCHES_CACHE or PATCHES_CACHE[path][0] != file_stamp:
+        patches = {}
+        for patch in json.load(open(path, 'r')):
+            for key in ["doc_id", "field", "value"]:
+                if key not in patch:
+                    raise ValueError(f"Invalid Patch: missing '{key}' in {patch}")
+            index = patch.get("relation")
+            if index is not None and (type(index) is not int or index < 0):
+                raise ValueError(f"Invalid Patch: relation must be a non-negative index or null in {patch}")
+            patches.setdefault(patch.get("doc_id"), []).append(patch)
+        PATCHES_CACHE[path] = (file_stamp, patches)
+    return PATCHES_CACHE[path][1]
+
+
+def load_patched(path: str, patch_path: str = PATCH_FILE) -> Dialog:
+    """
+    load a dialog from file applying edits from patch file (parsed patch file is cached)
+    :param path: path to a dialog file
+    :param patch_path: path to a patch file
+    :return:
+    """
+    data = json.load(open(path, 'r'))
+    return from_dict(patch_data(data, read_patches(patch_path).get(data.get("doc_id"), [])))
+
+
+def check_patches(data: str, patch_path: str = PATCH_FILE) -> t.List[t.Dict[str, t.Any]]:
+    """
+    report patch edits w.r.t. the original data (nothing is written)
+    :param data: path to data
+    :param patch_path: path to a patch file
+    :return: list of edits with original values
+    """
+    from corpus import DATA_DIRS, read_dir
+
+    patches = read_patches(patch_path)
+
+    report = []
+    for directory in DATA_DIRS.values():
+        for file_name in read_dir(os.path.join(data, directory)):
+            file_path = os.path.join(data, directory, file_name)
+            original = load(file_path)
+            edits = patches.get(original.doc_id, [])
+            if not edits:
+                continue
+
+            patched = load(file_path, edits)
+            for patch in edits:
+                index = patch.get("relation")
+                before = getattr(original if index is None else original.relations[index], patch.get("field"))
+                after = getattr(patched if index is None else patched.relations[index], patch.get("field"))
+                report.append({**patch, "original": before, "changed": before != after})
+    return report
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="LUNA Discourse patch overlay", prog='PROG')
+
+    add_argument_group_io(parser)
+
+    return parser
+
+
+def add_argument_group_io(parser):
+    argument_group = parser.add_argument_group("I/O Arguments")
+    argument_group.add_argument('-d', '--data', default='data', help="path to data")
+    argument_group.add_argument('-p', '--patch', required=False, help="path to patch file (default: patches.json in data)")
 
 
 if __name__ == "__main__":
-    fix_0704000020()
+    arg_parser = create_argument_parser()
+    args = arg_parser.parse_args()
+
+    patch_path = find_patches(args.data, args.patch)
+    if patch_path is None:
+        arg_parser.error(f"No patch file: {os.path.join(args.data, PATCH_NAME)}")
+
+    for edit in check_patches(args.data, patch_path):
+        print(edit)
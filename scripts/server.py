@@ -0,0 +1,455 @@
+""" Local Read-Only Query Server (and Client) over a preloaded LUNA Discourse Corpus """
+
+__author__ = "Evgeny A. Stepanov"
+__email__ = "stepanov.evgeny.a@gmail.com"
+__status__ = "dev"
+__version__ = "0.1.0"
+
+
+import typing as t
+
+from dataclasses import asdict
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from dialog import Dialog, DiscourseRelation, from_dict
+from corpus import Corpus
+
+import os
+import json
+import time
+import stat
+import socket
+import threading
+import socketserver
+import http.client
+import argparse
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+CACHE_SIZE = 1024  # number of cached responses
+WORKERS = 8  # request handling threads
+KEEP_ALIVE = 1.0  # idle seconds before a persistent connection is closed
+
+
+class QueryError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Metrics:
+
+    def __init__(self):
+        """
+        per endpoint request latency metrics
+        """
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def add(self, endpoint: str, latency: float, hit: bool):
+        with self.lock:
+            entry = self.data.setdefault(endpoint, {"count": 0, "hits": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["hits"] += int(hit)
+            entry["total"] += latency
+            entry["max"] = max(entry["max"], latency)
+
+    def report(self) -> t.Dict[str, t.Dict[str, float]]:
+        with self.lock:
+            return {k: {**v, "mean": v["total"] / v["count"]} for k, v in self.data.items()}
+
+
+class ResponseCache:
+
+    def __init__(self, size: int = CACHE_SIZE):
+        """
+        thread-safe LRU cache of encoded responses
+        :param size: max number of responses
+        """
+        self.size = size
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        with self.lock:
+            if key not in self.data:
+                return None
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def put(self, key: str, value: bytes):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+
+def query(corpus: Corpus, path: str, params: t.Dict[str, t.List[str]]) -> t.Any:
+    """
+    answer a query path over corpus:
+    /sets, /sets/<part>, /info/<doc_id>, /dialog/<doc_id>, /relations/<doc_id>[/<index>], /stats[?part=<part>]
+    :param corpus:
+    :param path:
+    :param params: query string parameters
+    :return: JSON-serializable result
+    """
+    parts = [part for part in path.split("/") if part]
+    if not parts:
+        raise QueryError(404, "No endpoint")
+
+    endpoint, args = parts[0], parts[1:]
+
+    def dialog(doc_id: str) -> Dialog:
+        if doc_id not in corpus.data:
+            raise QueryError(404, f"Unknown Dialog: {doc_id}")
+        return corpus.data[doc_id]
+
+    try:
+        if endpoint == "sets" and not args:
+            return corpus.sets
+        if endpoint == "sets" and len(args) == 1:
+            if args[0] not in corpus.sets:
+                raise QueryError(404, f"Unknown Corpus Part: {args[0]}")
+            return corpus.sets[args[0]]
+        if endpoint == "info" and len(args) == 1:
+            return dialog(args[0]).info
+        if endpoint == "dialog" and len(args) == 1:
+            return asdict(dialog(args[0]))
+        if endpoint == "relations" and len(args) == 1:
+            return [asdict(relation) for relation in dialog(args[0]).relations]
+        if endpoint == "relations" and len(args) == 2:
+            return asdict(dialog(args[0]).relations[int(args[1])])
+        if endpoint == "stats" and not args:
+            stats = corpus.stats(params.get("part", [None])[0])
+            # JSON keys: None sense as null-string & (label, sense) pairs as lists
+            return {k: ([[*key, value] for key, value in v.items()] if k == "paired" else
+                        {str(key): value for key, value in v.items()} if isinstance(v, dict) else v)
+                    for k, v in stats.items()}
+    except (IndexError, ValueError) as error:
+        raise QueryError(400, str(error))
+
+    raise QueryError(404, f"Unknown Endpoint: {path}")
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    # persistent connections (responses have Content-Length); idle ones are closed after server keep_alive
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        self.timeout = self.server.keep_alive
+        super().setup()
+
+    def do_GET(self):
+        start = time.perf_counter()
+
+        url = urlsplit(self.path)
+        endpoint = url.path.strip("/").split("/")[0]
+
+        if endpoint == "metrics":
+            status, body, hit = 200, json.dumps(self.server.metrics.report()).encode('utf-8'), False
+        else:
+            body = self.server.cache.get(self.path)
+            hit = body is not None
+            status = 200
+            if not hit:
+                try:
+                    body = json.dumps(query(self.server.corpus, url.path, parse_qs(url.query))).encode('utf-8')
+                    self.server.cache.put(self.path, body)
+                except QueryError as error:
+                    status, body = error.status, json.dumps({"error": str(error)}).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.waiting():
+            # connection holds a worker: free it for waiting connections
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+        self.server.metrics.add(endpoint, time.perf_counter() - start, hit)
+
+    def log_message(self, format, *args):
+        # quiet: latency is reported by /metrics
+        pass
+
+
+class PooledMixIn:
+    """ handle connections in a fixed thread pool """
+
+    pool: ThreadPoolExecutor = None
+    pending: t.Set[t.Any] = None  # connections waiting for a worker
+    request_queue_size = 128  # listen backlog for many concurrent clients
+
+    def waiting(self) -> bool:
+        return bool(self.pending)
+
+    def process_request(self, request, client_address):
+        self.pending.add(request)
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        self.pending.discard(request)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class QueryServer(PooledMixIn, HTTPServer):
+    pass
+
+
+class UnixQueryServer(PooledMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def make_server(corpus: Corpus,
+                host: str = DEFAULT_HOST,
+                port: int = DEFAULT_PORT,
+                socket_path: str = None,
+                workers: int = WORKERS,
+                cache_size: int = CACHE_SIZE,
+                keep_alive: float = KEEP_ALIVE
+                ) -> socketserver.BaseServer:
+    """
+    create query server over a loaded corpus, bound to localhost port or unix socket
+    :param corpus:
+    :param host:
+    :param port: (0 for any free port)
+    :param socket_path: path to unix socket (overrides host & port); stale socket file is replaced
+    :param workers: number of request handling threads
+    :param cache_size: number of cached responses
+    :param keep_alive: idle seconds before a persistent connection is closed
+    :return:
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise ValueError(f"Not a Socket: {socket_path}")
+            os.remove(socket_path)
+        server = UnixQueryServer(socket_path, QueryHandler)
+    else:
+        server = QueryServer((host, port), QueryHandler)
+
+    corpus.relations_frame()  # build shared stats data once before serving
+
+    server.corpus = corpus
+    server.pool = ThreadPoolExecutor(max_workers=workers)
+    server.pending = set()
+    server.keep_alive = keep_alive
+    server.cache = ResponseCache(cache_size)
+    server.metrics = Metrics()
+
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RemoteDialogs:
+
+    def __init__(self, client: "CorpusClient"):
+        """
+        read-only doc_id to Dialog mapping; dialogs are fetched on demand & kept
+        :param client:
+        """
+        self.client = client
+        self.dialogs = {}
+
+    def keys(self) -> t.List[str]:
+        return [doc_id for doc_ids in self.client.sets.values() for doc_id in doc_ids]
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.keys()
+
+    def __getitem__(self, doc_id: str) -> Dialog:
+        if doc_id not in self.dialogs:
+            self.dialogs[doc_id] = from_dict(self.client.request(f"/dialog/{doc_id}"))
+        return self.dialogs[doc_id]
+
+    def get(self, doc_id: str, default: t.Any = None) -> t.Any:
+        return self[doc_id] if doc_id in self else default
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self) -> t.List[Dialog]:
+        return [self[doc_id] for doc_id in self.keys()]
+
+    def items(self) -> t.List[t.Tuple[str, Dialog]]:
+        return [(doc_id, self[doc_id]) for doc_id in self.keys()]
+
+
+class CorpusClient:
+
+    # read-only Corpus API: data, sets, trn, dev, tst & stats are served;
+    # derived data (relations_frame, shard & cached for DataLoader, cooccurrence) is computed over fetched dialogs
+    version = 0  # served corpus does not change
+    cached = Corpus.cached
+    relations_frame = Corpus.relations_frame
+    shard = Corpus.shard
+
+    def __init__(self, address: str = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout: float = 30.0):
+        """
+        client mirroring (read-only) Corpus API over a query server
+        :param address: http://host:port or unix:///path/to/socket
+        :param timeout:
+        """
+        url = urlsplit(address)
+        if url.scheme not in ["http", "unix"]:
+            raise ValueError(f"Unknown Address Scheme: {address}")
+
+        self.address = address
+        self.timeout = timeout
+        self.local = threading.local()
+
+        self.data = RemoteDialogs(self)
+        self._sets = None
+
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def connection(self) -> http.client.HTTPConnection:
+        """
+        per thread persistent connection
+        :return:
+        """
+        if getattr(self.local, "connection", None) is None:
+            url = urlsplit(self.address)
+            if url.scheme == "unix":
+                self.local.connection = UnixHTTPConnection(url.path, timeout=self.timeout)
+            else:
+                self.local.connection = http.client.HTTPConnection(url.hostname, url.port, timeout=self.timeout)
+        return self.local.connection
+
+    def request(self, path: str) -> t.Any:
+        """
+        GET path & decode JSON response
+        :param path:
+        :return:
+        """
+        while True:
+            connection = self.connection()
+            reused = connection.sock is not None
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                body = json.loads(response.read().decode('utf-8'))
+                break
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self.local.connection = None
+                # server closed idle persistent connection: reconnect (fresh connection errors are raised)
+                if not reused:
+                    raise
+
+        if response.status != 200:
+            raise ValueError(body.get("error"))
+        return body
+
+    @property
+    def sets(self) -> t.Dict[str, t.List[str]]:
+        if self._sets is None:
+            self._sets = self.request("/sets")
+        return self._sets
+
+    @property
+    def trn(self) -> t.List[Dialog]:
+        return [self.data[doc_id] for doc_id in self.sets.get("trn", [])]
+
+    @property
+    def dev(self) -> t.List[Dialog]:
+        return [self.data[doc_id] for doc_id in self.sets.get("dev", [])]
+
+    @property
+    def tst(self) -> t.List[Dialog]:
+        return [self.data[doc_id] for doc_id in self.sets.get("tst", [])]
+
+    def info(self, doc_id: str) -> t.Dict[str, t.Union[str, int]]:
+        return self.request(f"/info/{doc_id}")
+
+    def relations(self, doc_id: str) -> t.List[DiscourseRelation]:
+        return [DiscourseRelation(**relation) for relation in self.request(f"/relations/{doc_id}")]
+
+    def stats(self, part: str = None) -> t.Dict[str, t.Dict[str, int]]:
+        """
+        corpus stats (as Corpus.stats)
+        :param part:
+        :return:
+        """
+        stats = self.request("/stats" + (f"?part={part}" if part else ""))
+        stats["senses"] = {(None if k == "None" else k): v for k, v in stats.get("senses").items()}
+        stats["paired"] = {(label, sense): v for label, sense, v in stats.get("paired")}
+        return stats
+
+    def metrics(self) -> t.Dict[str, t.Dict[str, float]]:
+        return self.request("/metrics")
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="LUNA Discourse query server", prog='PROG')
+
+    add_argument_group_io(parser)
+    add_argument_group_server(parser)
+
+    return parser
+
+
+def add_argument_group_io(parser):
+    argument_group = parser.add_argument_group("I/O Arguments")
+    argument_group.add_argument('-d', '--data', required=True, help="path to data")
+    argument_group.add_argument('-p', '--patches', required=False, help="path to patch file (default: patches.json in data)")
+    argument_group.add_argument('--no-patches', dest='patches', action='store_const', const=False,
+                                help="do not apply patches")
+
+
+def add_argument_group_server(parser):
+    argument_group = parser.add_argument_group("Server Arguments")
+    argument_group.add_argument('--host', default=DEFAULT_HOST, help="host to bind")
+    argument_group.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to bind")
+    argument_group.add_argument('-s', '--socket', required=False, help="path to unix socket (instead of port)")
+    argument_group.add_argument('-w', '--workers', type=int, default=WORKERS, help="number of threads")
+    argument_group.add_argument('--keep-alive', type=float, default=KEEP_ALIVE, help="idle connection timeout")
+
+
+if __name__ == "__main__":
+    arg_parser = create_argument_parser()
+    args = arg_parser.parse_args()
+
+    query_server = make_server(Corpus(args.data, patches=args.patches),
+                               host=args.host, port=args.port, socket_path=args.socket, workers=args.workers,
+                               keep_alive=args.keep_alive)
+    try:
+        query_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        query_server.server_close()
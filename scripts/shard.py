@@ -0,0 +1,160 @@
+""" Balanced Sharded Export & Shard Reader for LUNA Discourse Corpus """
+
+__author__ = "Evgeny A. Stepanov"
+__email__ = "stepanov.evgeny.a@gmail.com"
+__status__ = "dev"
+__version__ = "0.1.0"
+
+
+import typing as t
+
+from dataclasses import asdict
+
+from dialog import from_dict
+from corpus import Corpus
+
+import os
+import gzip
+import json
+import hashlib
+import argparse
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def checksum(path: str) -> str:
+    """
+    sha256 checksum of a file
+    :param path:
+    :return:
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_shard(path: str, mode: str = 'r'):
+    """
+    open shard file as text; gzip-compressed if path ends with .gz
+    :param path:
+    :param mode:
+    :return:
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def export_shards(corpus: Corpus,
+                  odir: str,
+                  n: int,
+                  by: str = "tokens",
+                  stratify: bool = True,
+                  compress: bool = False
+                  ) -> t.Dict[str, t.Any]:
+    """
+    write corpus as n balanced JSONL shards (1 dialog per line) & a manifest with checksums
+    :param corpus:
+    :param odir: output directory
+    :param n: number of shards
+    :param by: work measure (see Corpus.shard)
+    :param stratify: balance each split separately
+    :param compress: gzip shard files
+    :return: manifest
+    """
+    os.makedirs(odir, exist_ok=True)
+
+    files = []
+    for i, shard in enumerate(corpus.shard(n, by=by, stratify=stratify)):
+        file_name = f"shard-{i:03d}-of-{n:03d}.jsonl" + (".gz" if compress else "")
+        file_path = os.path.join(odir, file_name)
+
+        with open_shard(file_path, 'w') as fh:
+            for key, doc_ids in shard.items():
+                for doc_id in doc_ids:
+                    fh.write(json.dumps({"part": key, "dialog": asdict(corpus.data[doc_id])}) + "\n")
+
+        files.append({
+            "file": file_name,
+            "sha256": checksum(file_path),
+            "dialogs": sum([len(doc_ids) for doc_ids in shard.values()]),
+            "work": sum([corpus.data[d].info.get(by) or 0 for doc_ids in shard.values() for d in doc_ids]),
+            "parts": shard,
+        })
+
+    manifest = {"shards": n, "by": by, "stratify": stratify, "files": files}
+    json.dump(manifest, open(os.path.join(odir, MANIFEST_FILE), 'w'), indent=2)
+
+    return manifest
+
+
+def load_shard(path: str, index: int, verify: bool = True) -> Corpus:
+    """
+    load a single shard as a corpus
+    :param path: path to shard directory (with manifest)
+    :param index: shard index
+    :param verify: verify shard checksum against manifest
+    :return:
+    """
+    manifest = json.load(open(os.path.join(path, MANIFEST_FILE), 'r'))
+    files = manifest.get("files", [])
+
+    if not 0 <= index < len(files):
+        raise ValueError(f"Invalid Shard Index: {index} (shards: {len(files)})")
+
+    entry = files[index]
+    file_path = os.path.join(path, entry.get("file"))
+
+    if verify and checksum(file_path) != entry.get("sha256"):
+        raise ValueError(f"Shard Checksum Mismatch: {file_path}")
+
+    corpus = Corpus()
+    with open_shard(file_path, 'r') as fh:
+        for line in fh:
+            record = json.loads(line)
+            corpus.add(record.get("part"), from_dict(record.get("dialog")))
+
+    return corpus
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="LUNA Discourse Corpus sharding", prog='PROG')
+
+    add_argument_group_io(parser)
+    add_argument_group_shard(parser)
+
+    return parser
+
+
+def add_argument_group_io(parser):
+    argument_group = parser.add_argument_group("I/O Arguments")
+    argument_group.add_argument('-d', '--data', required=True, help="path to data (or shards, with --index)")
+
+    # mode: export data into odir or load shard by index
+    mode_group = argument_group.add_mutually_exclusive_group(required=True)
+    mode_group.add_argument('-o', '--odir', help="path to output directory (export)")
+    mode_group.add_argument('-i', '--index', type=int, help="shard index to load")
+
+
+def add_argument_group_shard(parser):
+    argument_group = parser.add_argument_group("Shard Arguments")
+    argument_group.add_argument('-n', '--shards', type=int, default=1, help="number of shards")
+    argument_group.add_argument('-b', '--by', default="tokens", help="work measure")
+    argument_group.add_argument('--across', action='store_true', help="pack all splits together")
+    argument_group.add_argument('--compress', action='store_true', help="gzip shard files")
+
+
+if __name__ == "__main__":
+    arg_parser = create_argument_parser()
+    args = arg_parser.parse_args()
+
+    if args.index is not None:
+        print(load_shard(args.data, args.index).stats())
+    else:
+        shards = export_shards(Corpus(args.data), args.odir, args.shards,
+                               by=args.by, stratify=not args.across, compress=args.compress)
+        for entry in shards.get("files"):
+            print(entry.get("file"), entry.get("dialogs"), entry.get("work"))
@@ -1,12 +1,14 @@
 """ test correctness of extracted spans & labels """
 
 from parser import parse_raw, parse_ann, parse_dialog, read_tabular
-from dialog import slice_text, slice_sequence
+from dialog import Dialog, slice_text, slice_sequence
+from dialog import indices_to_span, decode_spans
 from corpus import Corpus, read_dir
 
 from collections import Counter
 
 import os
+import argparse
 
 
 def read_annotations(path: str):
@@ -52,11 +54,12 @@ def annotation_stats(data):
     }
 
 
-def test_conversion(raw: str, ann: str):
+def test_conversion(raw: str, ann: str, dialog: Dialog = None):
     """
     test conversion
     :param raw: raw text file
     :param ann: annotation file
+    :param dialog: dialog parsed from raw & ann (parsed if None)
     :return:
     """
     def get_ann_text(span, txt):
@@ -67,7 +70,7 @@ def test_conversion(raw: str, ann: str):
 
     spans = ["conn", "arg1", "arg2", "sup1", "sup2"]
 
-    dialog = parse_dialog(raw, ann)
+    dialog = parse_dialog(raw, ann) if dialog is None else dialog
     text, tokens, blocks, groups, token_index = parse_raw(raw)
     relations = parse_ann(ann)
 
@@ -87,8 +90,8 @@ def test_corpus_senses(path: str, ann: str):
     :param path:
     :return:
     """
-    # json file stats
-    data = Corpus(path)
+    # json file stats (as converted: without patches)
+    data = Corpus(path, patches=False)
     stats = data.stats()
 
     dst_senses = {('' if k is None else k): v for k, v in stats.get("senses").items()}
@@ -120,10 +123,437 @@ def test_corpus_spans(raw: str, ann: str):
             test_conversion(os.path.join(raw, dir_name, file_name), os.path.join(ann, dir_name, file_name))
 
 
+def test_span_decoding(runs: int = 100, seed: int = 0):
+    """
+    test batch span decoding against indices_to_span on random masks
+    :param runs:
+    :param seed:
+    :return:
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    for _ in range(runs):
+        tags = rng.integers(0, 3, size=(rng.integers(1, 20), rng.integers(1, 50)))
+        for tag in [1, 2]:
+            spans = [indices_to_span(np.flatnonzero(row == tag).tolist()) for row in tags]
+            assert decode_spans(tags, tag=tag) == spans
+
+
+def test_corpus_stats(path: str):
+    """
+    test that frame-backed corpus stats match plain relation counts & follow corpus changes
+    :param path: path to data
+    :return:
+    """
+    corpus = Corpus(path)
+
+    for part in [None, "trn", "dev", "tst"]:
+        dialogs = getattr(corpus, part) if part else list(corpus.data.values())
+        paired = [(r.label, r.sense) for d in dialogs for r in d.relations]
+        stats = corpus.stats(part)
+
+        assert stats.get("labels") == dict(Counter([label for label, _ in paired]))
+        assert stats.get("senses") == dict(Counter([sense for _, sense in paired]))
+        assert stats.get("paired") == dict(Counter(paired))
+
+    corpus.dev[0].relations.pop()
+    corpus.touch()
+    assert corpus.stats().get("relations") == sum(corpus.stats().get("labels").values())
+
+    # concurrent callers share a single build
+    import threading
+    import time
+
+    builds = []
+    threads = [threading.Thread(target=corpus.cached, args=("test", lambda: builds.append(time.sleep(0.01))))
+               for _ in range(8)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert len(builds) == 1
+
+
+def test_loader(path: str):
+    """
+    test that an epoch covers every window once with padded batches & that prefetch threads stop
+    :param path: path to data
+    :return:
+    """
+    import threading
+    import time
+    from loader import DataLoader
+
+    loader = DataLoader(Corpus(path), part="dev", batch_size=8, prefetch=2, seed=0)
+
+    seen = []
+    for batch in loader:
+        assert batch["tokens"].shape == batch["roles"].shape == batch["mask"].shape
+        assert (batch["mask"].sum(axis=1) == batch["lengths"]).all()
+        assert (batch["tokens"][~batch["mask"]] == 0).all()
+        seen.extend(zip(batch["doc_id"], batch["index"]))
+
+    assert sorted(seen) == sorted([(w.doc_id, w.index) for w in loader.windows])
+
+    # windows are rebuilt only when the corpus changes; vocabulary is kept
+    windows, vocab = loader.windows, loader.vocab
+    assert loader.windows is windows
+    loader.corpus.dev[0].tokens = ["<new>"] + loader.corpus.dev[0].tokens[1:]
+    loader.corpus.dev[0].relations.pop()
+    loader.corpus.touch()
+    assert len(loader.windows) == len(windows) - 1
+    assert loader.vocab is vocab and "<new>" not in loader.vocab
+
+    loader.reset_vocab()
+    assert "<new>" in loader.vocab
+
+    threads = threading.active_count()
+    for _ in range(5):
+        for _ in loader:
+            break
+    time.sleep(0.5)
+    assert threading.active_count() <= threads
+
+
+def test_cooccurrence(path: str):
+    """
+    test contingency tables against plain Counter over relations & that they follow corpus changes
+    :param path: path to data
+    :return:
+    """
+    from cooccur import cooccurrence, connective_text
+
+    corpus = Corpus(path)
+
+    for part in [None, "dev"]:
+        dialogs = getattr(corpus, part) if part else list(corpus.data.values())
+        paired = Counter([(connective_text(d, r), r.label) for d in dialogs for r in d.relations])
+        table = cooccurrence(corpus, "connective", "label", part=part)
+
+        assert table.todict() == dict(paired)
+        assert table.total == sum(paired.values())
+
+    counts = cooccurrence(corpus, "label", "part").todict()
+    corpus.dev[0].relations.pop()
+    corpus.touch()
+    assert sum(cooccurrence(corpus, "label", "part").todict().values()) == sum(counts.values()) - 1
+
+
+def test_shards(path: str, n: int = 3):
+    """
+    test sharded export round-trip, work balance & checksum verification
+    :param path: path to data
+    :param n: number of shards
+    :return:
+    """
+    import tempfile
+    from shard import export_shards, load_shard
+
+    corpus = Corpus(path)
+    works = {doc_id: d.info.get("tokens") for doc_id, d in corpus.data.items()}
+
+    for compress in [False, True]:
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = export_shards(corpus, tmp, n, compress=compress)
+
+            loaded = [load_shard(tmp, i) for i in range(n)]
+            data = {doc_id: d.dump() for shard in loaded for doc_id, d in shard.data.items()}
+            assert data == {doc_id: d.dump() for doc_id, d in corpus.data.items()}
+            for key, doc_ids in corpus.sets.items():
+                assert sorted([x for shard in loaded for x in shard.sets.get(key, [])]) == sorted(doc_ids)
+
+            loads = [entry.get("work") for entry in manifest.get("files")]
+            assert sum(loads) == sum(works.values())
+            assert max(loads) - min(loads) <= len(corpus.sets) * max(works.values())
+
+            with open(os.path.join(tmp, manifest.get("files")[0].get("file")), 'ab') as fh:
+                fh.write(b"\n")
+            try:
+                load_shard(tmp, 0)
+                raise AssertionError("corrupted shard is not detected")
+            except ValueError:
+                pass
+
+
+def test_diff(path: str):
+    """
+    test data diff on a mutated copy: modified, added & removed dialogs & relations (fresh & cached fingerprints)
+    :param path: path to data
+    :return:
+    """
+    import json
+    import shutil
+    import tempfile
+    from diff import diff_corpus
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path, new_path = os.path.join(tmp, "old"), os.path.join(tmp, "new")
+        shutil.copytree(path, old_path, ignore=shutil.ignore_patterns(".*"))
+        shutil.copytree(path, new_path, ignore=shutil.ignore_patterns(".*"))
+
+        assert diff_corpus(old_path, new_path) == {"added": [], "removed": [], "modified": {}}
+
+        changed_name, removed_name = sorted(read_dir(os.path.join(new_path, "01")))[:2]
+        changed_path = os.path.join(new_path, "01", changed_name)
+        data = json.load(open(changed_path, 'r'))
+        data["relations"][0]["sense"] = "Changed.Sense"
+        data["relations"].pop()
+        json.dump(data, open(changed_path, 'w'))
+
+        removed = json.load(open(os.path.join(new_path, "01", removed_name), 'r'))
+        os.remove(os.path.join(new_path, "01", removed_name))
+        json.dump({**removed, "doc_id": "added"}, open(os.path.join(new_path, "01", "added.json"), 'w'))
+
+        for cache in [False, True]:
+            report = diff_corpus(old_path, new_path, cache=cache, patches=False)
+
+            assert report.get("added") == ["added"]
+            assert report.get("removed") == [removed.get("doc_id")]
+            assert list(report.get("modified").keys()) == [data.get("doc_id")]
+
+            delta = report.get("modified").get(data.get("doc_id"))
+            assert not delta.get("content") and not delta.get("added")
+            assert delta.get("removed") == [len(data["relations"])]
+            assert [(x.get("old"), x.get("new"), list(x.get("fields"))) for x in delta.get("modified")] == [(0, 0, ["sense"])]
+
+
+def test_watcher():
+    """
+    test incremental conversion: masking, missing & stale outputs, changed & malformed (retried) annotation files
+    :return:
+    """
+    import time
+    import tempfile
+    import warnings
+    from watch import Watcher
+    from dialog import load
+
+    text = "hello there\tbecause it works\nyes indeed\n"
+
+    def annotation(sense: str) -> str:
+        row = [""] * 27
+        row[0], row[1], row[8], row[14], row[20] = "Explicit", "12..19", sense, "0..11", "20..28"
+        return "|".join(row) + "\n"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw, ann, out = [os.path.join(tmp, x) for x in ["raw", "ann", "data"]]
+        dirs = {"dev": "01"}
+        for file_name in ["doc_1.txt", "doc_2.txt"]:
+            for path, content in [(raw, text), (ann, annotation("Contingency.Cause.Reason"))]:
+                os.makedirs(os.path.join(path, "01"), exist_ok=True)
+                open(os.path.join(path, "01", file_name), 'w').write(content)
+
+        masked = ["<PER>", "there", "because", "it", "works", "yes", "indeed"]
+        mask = os.path.join(tmp, "mask.tsv")
+        open(mask, 'w').write("".join([f"{doc_id}\t{token}\n" for doc_id in ["doc1", "doc2"] for token in masked]))
+
+        # raw tokens are not written without explicit consent
+        try:
+            Watcher(raw, ann, out, dirs)
+            raise AssertionError("watcher without mask file is not rejected")
+        except ValueError:
+            pass
+
+        # missing outputs are converted on first step; up-to-date outputs are not
+        watcher = Watcher(raw, ann, out, dirs, mask=mask)
+        assert sorted([d.doc_id for d in watcher.step()]) == ["doc1", "doc2"]
+        assert load(os.path.join(out, "01", "doc1.json")).tokens == masked
+        assert watcher.step() == []
+        assert Watcher(raw, ann, out, dirs, mask=mask).step() == []
+
+        # changed annotation
+        open(os.path.join(ann, "01", "doc_1.txt"), 'w').write(annotation("Expansion.Conjunction"))
+        assert [d.doc_id for d in watcher.step()] == ["doc1"]
+        assert watcher.stats().get("senses") == {"Expansion.Conjunction": 1, "Contingency.Cause": 1}
+
+        # malformed annotation: warned & retried until fixed
+        open(os.path.join(ann, "01", "doc_2.txt"), 'w').write("Explicit|27..2\n")
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            assert watcher.step() == []
+            assert watcher.step() == []
+        assert len([x for x in caught if "Conversion failed" in str(x.message)]) == 2
+
+        open(os.path.join(ann, "01", "doc_2.txt"), 'w').write(annotation("Expansion.Conjunction"))
+        assert [d.doc_id for d in watcher.step()] == ["doc2"]
+
+        # stale output: source changed while not watching
+        path = os.path.join(ann, "01", "doc_1.txt")
+        open(path, 'w').write(annotation("Contingency.Cause.Reason"))
+        os.utime(path, ns=(time.time_ns() + 10 ** 9, time.time_ns() + 10 ** 9))
+        assert [d.doc_id for d in Watcher(raw, ann, out, dirs, mask=mask).step()] == ["doc1"]
+
+        # missing masked tokens: not written with raw tokens
+        open(os.path.join(raw, "01", "doc_3.txt"), 'w').write(text)
+        open(os.path.join(ann, "01", "doc_3.txt"), 'w').write(annotation("Expansion.Conjunction"))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            assert watcher.step() == []
+        assert any(["No masked tokens" in str(x.message) for x in caught])
+        assert not os.path.exists(os.path.join(out, "01", "doc3.json"))
+
+
+def test_server(path: str):
+    """
+    test query server & client parity with local corpus over TCP & unix socket
+    :param path: path to data
+    :return:
+    """
+    import time
+    import tempfile
+    import threading
+    from server import make_server, CorpusClient
+    from loader import DataLoader
+    from cooccur import cooccurrence
+
+    corpus = Corpus(path)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # existing non-socket file is not replaced
+        file_path = os.path.join(tmp, "file.json")
+        open(file_path, 'w').write("{}")
+        try:
+            make_server(corpus, socket_path=file_path)
+            raise AssertionError("non-socket file is not protected")
+        except ValueError:
+            assert open(file_path).read() == "{}"
+
+        for socket_path in [None, os.path.join(tmp, "server.sock")]:
+            server = make_server(corpus, port=0, socket_path=socket_path, workers=2, keep_alive=0.2)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+
+            try:
+                address = f"unix://{socket_path}" if socket_path else "http://{}:{}".format(*server.server_address)
+                client = CorpusClient(address)
+
+                assert client.sets == corpus.sets
+                for part in [None, "trn", "dev", "tst"]:
+                    assert client.stats(part) == corpus.stats(part)
+
+                # Corpus consumers
+                assert client.relations_frame("dev").count("label", "sense") == corpus.relations_frame("dev").count(
+                    "label", "sense")
+                assert client.shard(3) == corpus.shard(3)
+                assert cooccurrence(client).todict() == cooccurrence(corpus).todict()
+                assert [(w.doc_id, w.index, w.tokens.tolist()) for w in DataLoader(client, part="dev").windows] == \
+                       [(w.doc_id, w.index, w.tokens.tolist()) for w in DataLoader(corpus, part="dev").windows]
+
+                for dialog in corpus.dev:
+                    assert client.data[dialog.doc_id].dump() == dialog.dump()
+                    assert client.info(dialog.doc_id) == dialog.info
+                    assert client.relations(dialog.doc_id) == dialog.relations
+
+                try:
+                    client.stats("unknown")
+                    raise AssertionError("unknown part is not reported")
+                except ValueError:
+                    pass
+
+                # connection is kept between requests & re-opened after idle timeout
+                sock = client.connection().sock
+                client.info(corpus.dev[0].doc_id)
+                assert sock is not None and client.connection().sock is sock
+                time.sleep(0.5)
+                assert client.info(corpus.dev[0].doc_id) == corpus.dev[0].info
+                assert client.connection().sock is not sock
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+
+def test_patches(path: str):
+    """
+    test patch overlay: applied by default, reverted with patches=False & re-read when patch file changes
+    :param path: path to data
+    :return:
+    """
+    import json
+    import tempfile
+    from patch import PATCH_NAME, load_patched
+
+    original = Corpus(path, patches=False)
+    doc_id = sorted(original.sets.get("dev"))[0]
+    file_path = os.path.join(path, "01", f"{doc_id}.json")
+    sense = original.data[doc_id].relations[0].sense
+
+    if os.path.isfile(os.path.join(path, PATCH_NAME)):
+        default = Corpus(path)
+        explicit = Corpus(path, patches=os.path.join(path, PATCH_NAME))
+        assert {k: d.dump() for k, d in default.data.items()} == {k: d.dump() for k, d in explicit.data.items()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        patch_path = os.path.join(tmp, PATCH_NAME)
+
+        for i, value in enumerate(["Patched.First", "Patched.Second"]):
+            json.dump([{"doc_id": doc_id, "relation": 0, "field": "sense", "value": value}], open(patch_path, 'w'))
+            os.utime(patch_path, ns=(i * 10 ** 9, i * 10 ** 9))
+
+            assert load_patched(file_path, patch_path).relations[0].sense == value
+            patched = Corpus(path, patches=patch_path)
+            assert patched.data[doc_id].relations[0].sense == value
+            assert patched.stats().get("senses").get(value) == 1
+
+        # relation index must be absolute
+        for i, index in enumerate([-1, "0"], start=2):
+            json.dump([{"doc_id": doc_id, "relation": index, "field": "sense", "value": "X"}], open(patch_path, 'w'))
+            os.utime(patch_path, ns=(i * 10 ** 9, i * 10 ** 9))
+            try:
+                load_patched(file_path, patch_path)
+                raise AssertionError(f"invalid relation index is not rejected: {index!r}")
+            except ValueError:
+                pass
+
+    assert Corpus(path, patches=False).data[doc_id].relations[0].sense == sense
+
+
+def test_startup(runs: int = 5):
+    """
+    test startup time of cli & reader modules against budget (NumPy must not be imported)
+    :param runs:
+    :return:
+    """
+    from cli import benchmark_startup
+
+    result = benchmark_startup(runs=runs)
+
+    assert result.get("overhead") <= result.get("budget"), result
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="LUNA Discourse tests", prog='PROG')
+
+    add_argument_group_io(parser)
+
+    return parser
+
+
+def add_argument_group_io(parser):
+    argument_group = parser.add_argument_group("I/O Arguments")
+    argument_group.add_argument('-d', '--data', default='data', help="path to data")
+    argument_group.add_argument('-r', '--raw', default='wdir/raw', help="path to raw text tree")
+    argument_group.add_argument('-a', '--ann', default='wdir/ann', help="path to annotation tree")
+    argument_group.add_argument('--bench', action='store_true', help="also test startup time (after data tests)")
+
+
 if __name__ == "__main__":
-    data_path = 'data'
-    ann_path = 'wdir/ann'
-    raw_path = 'wdir/raw'
+    arg_parser = create_argument_parser()
+    args = arg_parser.parse_args()
+
+    # data correctness
+    test_span_decoding()
+    test_corpus_senses(args.data, args.ann)
+    test_corpus_spans(args.raw, args.ann)
+
+    test_corpus_stats(args.data)
+    test_cooccurrence(args.data)
+    test_patches(args.data)
+    test_loader(args.data)
+    test_shards(args.data)
+    test_diff(args.data)
+    test_server(args.data)
+    test_watcher()
 
-    test_corpus_senses(data_path, ann_path)
-    test_corpus_spans(raw_path, ann_path)
+    # timing: machine-dependent
+    if args.bench:
+        test_startup()
@@ -0,0 +1,308 @@
+""" watch raw & annotation trees and incrementally re-convert changed dialogs """
+
+__author__ = "Evgeny A. Stepanov"
+__email__ = "stepanov.evgeny.a@gmail.com"
+__status__ = "dev"
+__version__ = "0.1.0"
+
+
+import typing as t
+import warnings as w
+
+from collections import Counter
+
+from dialog import Dialog, load
+from corpus import DATA_DIRS, read_dir
+from parser import parse_dialog, parse_mask, gen_id
+from test import test_conversion
+
+import os
+import time
+import json
+import hashlib
+import argparse
+
+
+# file state: (mtime_ns, size), sha1
+FileState = t.Tuple[t.Tuple[int, int], str]
+
+
+def file_hash(path: str) -> str:
+    """
+    sha1 of file content
+    :param path:
+    :return:
+    """
+    with open(path, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+class Watcher:
+
+    def __init__(self,
+                 raw: str,
+                 ann: str,
+                 odir: str,
+                 dirs: t.Dict[str, str] = None,
+                 mask: str = None,
+                 verify: bool = True,
+                 unmasked: bool = False):
+        """
+        poll raw text & annotation trees (same file names in dirs) & re-convert changed dialogs into odir
+        :param raw: path to raw text tree
+        :param ann: path to annotation tree
+        :param odir: path to output data tree
+        :param dirs: split directories
+        :param mask: path to masked tokens file (required: data is released anonymized)
+        :param verify: verify span texts (test_conversion) before writing
+        :param unmasked: allow writing raw (not anonymized) tokens without mask file
+        """
+        if mask is None and not unmasked:
+            raise ValueError("No mask file: output would contain raw tokens (allow explicitly with unmasked)")
+
+        self.raw = raw
+        self.ann = ann
+        self.odir = odir
+        self.dirs = DATA_DIRS if dirs is None else dirs
+        self.masker = parse_mask(mask) if mask else None
+        self.verify = verify
+
+        self.files = {}  # path -> FileState (of successfully converted sources)
+        self.paired = {}  # (directory, file name) -> Counter of (label, sense)
+        self.totals = Counter()  # running sum of paired
+
+        self.init_files()
+        self.init_stats()
+
+    def sources(self) -> t.List[t.Tuple[str, str]]:
+        """
+        list (directory, file name) pairs present in raw tree
+        :return:
+        """
+        pairs = []
+        for directory in self.dirs.values():
+            if os.path.isdir(os.path.join(self.raw, directory)):
+                pairs.extend([(directory, file_name) for file_name in read_dir(os.path.join(self.raw, directory))])
+        return sorted(pairs)
+
+    def paths(self, directory: str, file_name: str) -> t.Tuple[str, str]:
+        return os.path.join(self.raw, directory, file_name), os.path.join(self.ann, directory, file_name)
+
+    def state(self, path: str) -> t.Optional[FileState]:
+        """
+        file state; content is re-hashed only if modification time or size changed
+        :param path:
+        :return:
+        """
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        known = self.files.get(path)
+        if known and known[0] == stamp:
+            return known
+        return stamp, file_hash(path)
+
+    def scan(self) -> t.Dict[t.Tuple[str, str], t.Dict[str, FileState]]:
+        """
+        find (directory, file name) pairs whose raw or annotation content changed since last conversion;
+        new file states are returned to be recorded once conversion succeeds
+        :return: new raw & annotation file states by (directory, file name)
+        """
+        changed = {}
+        current = set()
+        for directory, file_name in self.sources():
+            states = {}
+            for path in self.paths(directory, file_name):
+                current.add(path)
+                known = self.files.get(path)
+                state = self.state(path)
+                states[path] = state
+                if path not in self.files or (known and known[1]) != (state and state[1]):
+                    changed[(directory, file_name)] = states
+            if (directory, file_name) not in changed:
+                self.files.update(states)  # refresh modification stamps of unchanged content
+
+        for path in set(self.files) - current:
+            del self.files[path]
+
+        for key in set(self.paired) - set(self.sources()):
+            w.warn(f"Source removed: {os.path.join(*key)} (output is kept)")
+            self.update_stats(key, None)
+
+        return changed
+
+    def output(self, directory: str, doc_id: str) -> str:
+        return os.path.join(self.odir, directory, f"{doc_id}.json")
+
+    def source_output(self, directory: str, file_name: str) -> str:
+        return self.output(directory, gen_id(file_name))
+
+    def init_files(self):
+        """
+        initialize file states from existing output files: sources whose output is missing
+        or older than raw or annotation file are left unrecorded & are converted on first step
+        :return:
+        """
+        for directory, file_name in self.sources():
+            paths = self.paths(directory, file_name)
+            path = self.source_output(directory, file_name)
+            if not os.path.isfile(path) or not all([os.path.isfile(x) for x in paths]):
+                continue
+            if os.stat(path).st_mtime_ns >= max([os.stat(x).st_mtime_ns for x in paths]):
+                self.files.update({x: self.state(x) for x in paths})
+
+    def init_stats(self):
+        """
+        initialize statistics from existing output files
+        :return:
+        """
+        for directory, file_name in self.sources():
+            path = self.source_output(directory, file_name)
+            if os.path.isfile(path):
+                self.update_stats((directory, file_name), Counter([(r.label, r.sense) for r in load(path).relations]))
+
+    def convert(self, directory: str, file_name: str) -> t.Optional[Dialog]:
+        """
+        re-convert a dialog; output is written only if it differs from existing file (otherwise it is touched)
+        :param directory:
+        :param file_name:
+        :return: dialog if written
+        """
+        raw_path, ann_path = self.paths(directory, file_name)
+
+        if not os.path.isfile(ann_path):
+            w.warn(f"No annotation file: {ann_path}")
+            return None
+
+        dialog = parse_dialog(raw_path, ann_path)
+
+        if self.verify:
+            try:
+                test_conversion(raw_path, ann_path, dialog)
+            except AssertionError:
+                w.warn(f"Span check failed: {raw_path} (output is not updated)")
+                return None
+
+        if self.masker:
+            masker_tokens = self.masker.get(dialog.doc_id)
+            if masker_tokens is None:
+                raise ValueError(f"No masked tokens: {dialog.doc_id}")
+            if len(masker_tokens) != len(dialog.tokens):
+                raise ValueError(f"Masked tokens mismatch: {len(masker_tokens)} != {len(dialog.tokens)}")
+            dialog.tokens = masker_tokens
+
+        self.update_stats((directory, file_name), Counter([(r.label, r.sense) for r in dialog.relations]))
+
+        path = self.output(directory, dialog.doc_id)
+        if os.path.isfile(path) and json.load(open(path, 'r')) == json.loads(json.dumps(dialog.dump())):
+            os.utime(path)  # mark output as up to date w.r.t. sources
+            return None
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        dialog.dump(path)
+        return dialog
+
+    def step(self) -> t.List[Dialog]:
+        """
+        single poll: re-convert changed dialogs; dialogs failing to convert are reported & retried on next poll
+        :return: list of written dialogs
+        """
+        written = []
+        for (directory, file_name), states in self.scan().items():
+            try:
+                dialog = self.convert(directory, file_name)
+            except Exception as e:
+                w.warn(f"Conversion failed: {os.path.join(directory, file_name)}: {e!r} (retried on next poll)")
+                continue
+
+            self.files.update(states)
+            if dialog:
+                written.append(dialog)
+
+        return written
+
+    def update_stats(self, key: t.Tuple[str, str], paired: t.Optional[Counter]):
+        """
+        replace dialog (label, sense) counts in running totals
+        :param key: (directory, file name)
+        :param paired: new counts (None to remove dialog)
+        :return:
+        """
+        self.totals.subtract(self.paired.pop(key, Counter()))
+        if paired is not None:
+            self.paired[key] = paired
+            self.totals.update(paired)
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        """
+        label & sense stats over converted dialogs (as Corpus.stats)
+        :return:
+        """
+        paired = {k: v for k, v in self.totals.items() if v > 0}
+        labels, senses = Counter(), Counter()
+        for (label, sense), count in paired.items():
+            labels[label] += count
+            senses[sense] += count
+        return {
+            "dialog": len(self.paired),
+            "relations": sum(paired.values()),
+            "labels": dict(labels),
+            "senses": dict(senses),
+            "paired": paired,
+        }
+
+    def run(self, interval: float = 1.0, initial: bool = False):
+        """
+        poll until interrupted
+        :param interval: polling interval in seconds
+        :param initial: re-convert all dialogs on start
+        :return:
+        """
+        if initial:
+            self.files = {}
+
+        try:
+            while True:
+                for dialog in self.step():
+                    print(f"updated: {dialog.doc_id} {dialog.info}")
+                    print(self.stats().get("labels"))
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="LUNA Discourse watch & re-convert", prog='PROG')
+
+    add_argument_group_io(parser)
+    add_argument_group_watch(parser)
+
+    return parser
+
+
+def add_argument_group_io(parser):
+    argument_group = parser.add_argument_group("I/O Arguments")
+    argument_group.add_argument('-r', '--raw', default='wdir/raw', help="path to raw text tree")
+    argument_group.add_argument('-a', '--ann', default='wdir/ann', help="path to annotation tree")
+    argument_group.add_argument('-o', '--odir', required=True, help="path to output data tree")
+    argument_group.add_argument('-m', '--mask', required=False, help="path to masked file (required w/o --unmasked)")
+    argument_group.add_argument('--unmasked', action='store_true', help="write raw tokens without mask file")
+
+
+def add_argument_group_watch(parser):
+    argument_group = parser.add_argument_group("Watch Arguments")
+    argument_group.add_argument('-i', '--interval', type=float, default=1.0, help="polling interval (seconds)")
+    argument_group.add_argument('--initial', action='store_true', help="re-convert all dialogs on start")
+    argument_group.add_argument('--no-verify', dest='verify', action='store_false', help="skip span checks")
+
+
+if __name__ == "__main__":
+    arg_parser = create_argument_parser()
+    args = arg_parser.parse_args()
+
+    if not args.mask and not args.unmasked:
+        arg_parser.error("-m/--mask is required (or --unmasked to write raw tokens)")
+
+    watcher = Watcher(args.raw, args.ann, args.odir, mask=args.mask, verify=args.verify, unmasked=args.unmasked)
+    watcher.run(interval=args.interval, initial=args.initial)